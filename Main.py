@@ -16,11 +16,15 @@ st.set_page_config(
 if not check_password():  
     st.stop()
 
-from dotenv import load_dotenv
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
-from logics.datafile import filter_and_get_reliefs, capture_and_store
-from helper_functions.llm import get_chatbot_response
+import re
+import threading
+from helper_functions.vector_store import get_vector_store, current_fingerprint
+from helper_functions.hybrid_retriever import HybridRetriever
+from logics.datafile import filter_and_get_reliefs, capture_and_store, get_eligible_reliefs
+from logics.relieftagging import relief_filter, is_relief_tagged
+from helper_functions.llm import get_chatbot_response, load_environment
+from helper_functions.api_client import api_url, get_reliefs, stream_chat, stream_rental_analysis
+from helper_functions.conversation_store import get_conversation_store, new_session_id
 import pandas as pd
 import requests.exceptions
 
@@ -69,23 +73,48 @@ st.markdown("""
 
 # region <--------- Initialise env variables and load vector store --------->
 
-load_dotenv('.env')
+# Only loads the .env file on the first run of the process, not on every rerun
+load_environment()
 
 # Load the vector store collection for tax reliefs
 # Refer to the generate_chroma_db_for_reliefs.py script at the root folder to create the vector store
 # cache this resource for faster loading
 @st.cache_resource
 def load_vector_store():
-    embeddings_model = OpenAIEmbeddings(model='text-embedding-3-small')
-    vector_store = Chroma(
-        collection_name="various_tax_relief",
-        embedding_function=embeddings_model,
-        persist_directory="./chroma_langchain_db"
-    )
-    return vector_store      
+    vector_store = get_vector_store("various_tax_relief")
+    # Identifies the collection's content for the answer cache; computed once here, then refreshed periodically
+    current_fingerprint(vector_store)
+    return vector_store
+
+# Warm up the rental analysis resources in the background once per process,
+# so the first user to request a report does not pay for opening the vector store.
+# It is started at the end of the script, so importing the rental pipeline does not delay the first page
+@st.cache_resource
+def warm_up_rental_pipeline():
+    from logics.rentalcalculatorlangchain import warm_up_rental_resources
+    thread = threading.Thread(target=warm_up_rental_resources, daemon=True)
+    thread.start()
+    return thread
+
+# The retriever is cached as well so every rerun and session reuses the same QA chain
+# (see get_qa_chain in helper_functions/llm.py).
+# With RETRIEVAL_MODE=hybrid it fuses vector search with a BM25 index, see helper_functions/hybrid_retriever.py
+@st.cache_resource
+def load_retriever():
+    return HybridRetriever.from_vector_store(load_vector_store(), k=5)
+
+# Whether the chunks carry relief flags (see logics/relieftagging.py), so the chat can be
+# restricted to the reliefs the user is eligible for; collections built before tagging are searched whole
+@st.cache_resource
+def relief_tags_available():
+    return is_relief_tagged(load_retriever().vectorstore._collection.get(include=["metadatas"])["metadatas"])
 
-vector_store = load_vector_store()
-retriever = vector_store.as_retriever(k=5)
+# With TAXEASE_API_URL set, the app is a client of the service in api.py and runs no pipeline itself
+use_api = bool(api_url())
+
+if not use_api:
+    vector_store = load_vector_store()
+    retriever = load_retriever()
 
 # region <--------- Setup system message and initialise messages object --------->
 
@@ -102,11 +131,23 @@ channels:
 3. Email: https://mytax.iras.gov.sg/portal/correspondence/mytax-mail
 """
 
-# Always initiate the chatbot with the system message
-if "messages" not in st.session_state:
-    st.session_state.messages = [
-        {"role": "system", "content": system_message}
-    ]
+# The conversation, the profile and the eligible reliefs of each session are kept in the conversation store
+# (see helper_functions/conversation_store.py) rather than in st.session_state, so server memory stays bounded.
+# Only the session id is kept in st.session_state. It is not put in the URL, where anyone given the link
+# could read the conversation back
+conversation_store = get_conversation_store()
+if "session_id" not in st.session_state:
+    st.session_state.session_id = new_session_id()
+session_id = st.session_state.session_id
+
+# Always initiate the chatbot with the system message, which is not stored
+def chat_messages(conversation):
+    return [{"role": "system", "content": system_message}] + conversation.messages
+
+# The chatbot and the service return plain text; st.markdown would read amounts such as "$1,000 and $2,000"
+# as LaTeX, so $ is escaped when rendering. Messages saved before this are already escaped and left as they are
+def escape_dollars(text):
+    return re.sub(r"(?<!\\)\$", r"\\$", text)
 
 # region <--------- Page Title and Header --------->
 
@@ -181,26 +222,33 @@ with relief:
 
     if submit_filter:
         with st.spinner('Finding eligible tax reliefs...'):
-            # The capture_and_store function is available in .logics>datafile.py
-            # Does not require all 5 profile attributes to be provided
-            user_prompt = capture_and_store(citizenship=citizenship, 
-                                            gender=gender,
-                                            maritial_status=maritial_status,
-                                            employment=employment,
-                                            children=children)
-            
-            # Insert this in to the messages object as the user's initial query
-            st.session_state.messages.append({"role": "user", "content": user_prompt})
+            profile_answers = dict(citizenship=citizenship,
+                                   gender=gender,
+                                   maritial_status=maritial_status,
+                                   employment=employment,
+                                   children=children)
+            if use_api:
+                # The service runs the same three functions of .logics>datafile.py
+                lookup = get_reliefs(**profile_answers)
+                user_prompt = lookup["profile"]
+                eligible_reliefs = lookup["eligible_reliefs"]
+                llm_response = lookup["response"]
+            else:
+                # The capture_and_store function is available in .logics>datafile.py
+                # Does not require all 5 profile attributes to be provided
+                user_prompt = capture_and_store(**profile_answers)
+                eligible_reliefs = get_eligible_reliefs(**profile_answers)
+                # The filter_and_get_reliefs function is available in .logic>datafile.py
+                llm_response = filter_and_get_reliefs(**profile_answers)
             
-            # The filter_and_get_reliefs function is available in .logic>datafile.py
-            llm_response = filter_and_get_reliefs(citizenship=citizenship, 
-                                            gender=gender,
-                                            maritial_status=maritial_status,
-                                            employment=employment,
-                                            children=children)
+            # Insert this in to the conversation as the user's initial query
+            conversation_store.append(session_id, "user", user_prompt)
+            # Keep the profile to scope the cached chatbot answers,
+            # and the eligible reliefs to restrict the chunks retrieved for the chat
+            conversation_store.set_profile(session_id, user_prompt, eligible_reliefs)
             
-            # Insert this into the messages object as the assistant's response to user's initial query        
-            st.session_state.messages.append({"role": "assistant", "content": llm_response})
+            # Insert this into the conversation as the assistant's response to user's initial query        
+            conversation_store.append(session_id, "assistant", llm_response)
 
 # region <--------- Use Case 1: Chat Conversation region --------->
     st.subheader("Chat Conversation")
@@ -212,46 +260,71 @@ with relief:
 
     # Chat input box 
     if prompt := st.chat_input("Ask me anything related to Singapore tax reliefs:"):
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        conversation_store.append(session_id, "user", prompt)
+        conversation = conversation_store.load(session_id)
 
-        # Show spinner while generating response
+        # Only search the chunks of the reliefs the user is eligible for, once the form is submitted
+        retrieval_filter = None
+        if not use_api and relief_tags_available():
+            retrieval_filter = relief_filter(conversation.eligible_reliefs)
+
+        # Show spinner while retrieving the relevant information
         with spinner_placeholder:
             with st.spinner('Thinking...'):
-                response = get_chatbot_response(prompt=prompt,
-                                          retriever=retriever,
-                                          messages=st.session_state.messages) # refer to messages object for earlier conversations
+                if use_api:
+                    # The service builds the same retrieval filter from the eligible reliefs
+                    response_stream = stream_chat(prompt,
+                                                  chat_messages(conversation),
+                                                  profile=conversation.profile,
+                                                  eligible_reliefs=conversation.eligible_reliefs)
+                else:
+                    response_stream = get_chatbot_response(prompt=prompt,
+                                              retriever=retriever,
+                                              messages=chat_messages(conversation), # refer to messages object for earlier conversations
+                                              profile=conversation.profile,
+                                              retrieval_filter=retrieval_filter,
+                                              fingerprint=current_fingerprint(vector_store),
+                                              stream=True)
         
-        # Clear the spinner placeholder after response is generated
+        # Clear the spinner placeholder once the response starts streaming
         spinner_placeholder.empty()
-        
-        st.session_state.messages.append({"role": "assistant", "content": response})
 
     # Display messages in chat container
     with chat_container:
-        if len(st.session_state.messages) > 1:
-            for message in st.session_state.messages:
-                # Omit the display of system message
-                if message["role"] != "system":
-                    with st.chat_message(message["role"]):
-                        st.markdown(message["content"])
+        conversation = conversation_store.load(session_id)
+        if conversation.messages:
+            # Only the newest messages are kept for display once a long conversation is compacted
+            if conversation.archived:
+                st.caption(f"{conversation.archived} earlier messages are not shown.")
+            for message in conversation.messages:
+                with st.chat_message(message["role"]):
+                    st.markdown(escape_dollars(message["content"]))
         else:
             # Show a placeholder or initial instruction when no messages exist
             st.info("Your chat history will appear here after you submit the form or start chatting.")
 
+        # Render the new response token by token as it is generated
+        if prompt:
+            with st.chat_message("assistant"):
+                # The answer is stored as received, only the rendered chunks are escaped
+                chunks = []
+                def render(stream):
+                    for chunk in stream:
+                        chunks.append(chunk)
+                        yield escape_dollars(chunk)
+                st.write_stream(render(response_stream))
+            conversation_store.append(session_id, "assistant", "".join(chunks))
+
     # Clear chat button 
     if st.button("Clear Chat", key="clear_chat"):
-        # Clear all earlier messages except the system message
-        st.session_state.messages = [
-            {"role": "system", "content": system_message}
-        ]
+        # Clear all earlier messages, the profile and the eligible reliefs of the session
+        conversation_store.clear(session_id)
 
 
 # region <--------- Use Case 2:  Rental Income Tax Calculator --------->
 
-import pandas as pd
 # from logics.crew_analysis import run_crew_analysis # CrewAi not compatible with ChromaDB on streamlit :(
-from logics.rentalcalculatorlangchain import run_rental_analysis
-import requests.exceptions
+# The rental pipeline (langchain chains, serpapi) is imported when a report is requested, see below
 
 with rent:
     # def collect_rental_income_data():
@@ -399,23 +472,30 @@ with rent:
         if not st.session_state.properties:
             st.error("No properties found. Please add property information first.")
         else:
-            with st.spinner("Analysing rental income... This may take a few minutes."):
+            with st.spinner("Analysing rental income... The report will appear as it is written."):
                 try:
 
                     # Run the analysis with the provided path
                     # result = run_crew_analysis(property_list) # CrewAI script not used
-                    result = run_rental_analysis(property_list)
-                    result = result.replace("$", "\\$") # escape the $ character which may distort markdown formatting
-                    
+                    if use_api:
+                        result_stream = stream_rental_analysis(property_list)
+                    else:
+                        from logics.rentalcalculatorlangchain import run_rental_analysis
+                        result_stream = run_rental_analysis(property_list, stream=True)
                     
                     st.markdown("## Analysis Results")
-                    st.markdown(result)                   
+                    # escape the $ character which may distort markdown formatting
+                    st.write_stream(escape_dollars(chunk) for chunk in result_stream)
 
                 # Handle execptions gracefully        
                 except requests.exceptions.ConnectionError:
                     st.error("❌ Connection error occurred. Please check your internet connection.")
                     st.info("This tool requires internet access to perform the analysis.")
                 
+                except ValueError as e:
+                    # Raised when the property data is too large to send to the model
+                    st.error(f"❌ {str(e)}")
+
                 except KeyError as e:
                     st.error(f"❌ Missing required environment variable: {str(e)}")
                     st.info("Please ensure all required environment variables are set in your .env file.")            
@@ -423,3 +503,7 @@ with rent:
                 except Exception as e:
                     st.error(f"❌ An unexpected error occurred: {str(e)}")
                     st.info("If this persists, please check your setup and try again.")
+
+# Started last, once the page has been sent, see warm_up_rental_pipeline
+if not use_api:
+    warm_up_rental_pipeline()
@@ -0,0 +1,220 @@
+__import__('pysqlite3')
+import sys
+sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+
+# ================== Note =================
+# HTTP service exposing the relief lookup, the relief chatbot and the rental analysis of Main.py,
+# so they can be load-balanced and called from other systems. Main.py becomes one of its clients
+# when TAXEASE_API_URL is set (see helper_functions/api_client.py).
+#   POST /reliefs          profile -> eligible reliefs, the reply of filter_and_get_reliefs and the profile text
+#   POST /chat             question and conversation -> get_chatbot_response
+#   POST /rental/analysis  properties -> run_rental_analysis
+#   GET  /health           which shared resources are loaded and the answer cache metrics
+# /chat and /rental/analysis stream the answer as server-sent events when the body has "stream": true.
+# Every worker process opens the vector stores, LLM clients and chains once and shares them across requests.
+# If TAXEASE_API_KEY is set, requests must send it in the X-API-Key header.
+# With TAXEASE_STUB_MODELS=1 the LLM and embeddings are replaced by stubs (see helper_functions/stub_models.py).
+# Run from the root folder: python api.py --workers 4
+# ================== ==== =================
+
+import argparse
+import hmac
+import json
+import os
+import threading
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Iterator, List, Optional
+
+import anyio.to_thread
+import uvicorn
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+
+from helper_functions.hybrid_retriever import HybridRetriever
+from helper_functions.llm import get_chatbot_response, get_qa_chain, load_environment
+from helper_functions.semantic_cache import semantic_cache
+from helper_functions.stub_models import STUB_MODELS
+from helper_functions.vector_store import get_vector_store, is_vector_store_loaded, collection_fingerprint
+from logics.datafile import filter_and_get_reliefs, capture_and_store, get_eligible_reliefs, get_relief_table
+from logics.relieftagging import relief_filter, is_relief_tagged
+from logics.rentalbatch import property_from_record
+from logics.rentalcalculatorlangchain import run_rental_analysis, rental_resources_health, warm_up_rental_resources
+
+load_environment()
+
+RELIEF_COLLECTION = "various_tax_relief"
+
+API_WORKERS = int(os.getenv("API_WORKERS", 2))
+# Threads per worker for the blocking retrieval and LLM calls; a streamed answer holds one while it waits
+# for the next token, so this bounds the requests a worker serves at once
+API_THREADS = int(os.getenv("API_THREADS", 100))
+
+
+# The relief retriever is built once per worker, like load_retriever in Main.py,
+# so every chat request reuses the same QA chain (see get_qa_chain in helper_functions/llm.py)
+@lru_cache(maxsize=None)
+def get_retriever():
+    return HybridRetriever.from_vector_store(get_vector_store(RELIEF_COLLECTION), k=5)
+
+# Collections built before relief tagging are searched whole, see logics/relieftagging.py
+@lru_cache(maxsize=None)
+def relief_tags_available():
+    return is_relief_tagged(get_retriever().vectorstore._collection.get(include=["metadatas"])["metadatas"])
+
+
+@asynccontextmanager
+async def lifespan(app):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = API_THREADS
+    # The relief table, retriever, QA chain and collection fingerprint are ready before the worker accepts
+    # requests, the rental pipeline is warmed up in the background
+    await run_in_threadpool(get_relief_table)
+    await run_in_threadpool(relief_tags_available)
+    await run_in_threadpool(get_qa_chain, get_retriever())
+    await run_in_threadpool(collection_fingerprint, RELIEF_COLLECTION)
+    threading.Thread(target=warm_up_rental_resources, daemon=True).start()
+    yield
+
+
+def check_api_key(x_api_key: Optional[str] = Header(default=None)):
+    expected = os.getenv("TAXEASE_API_KEY")
+    if expected and not hmac.compare_digest(x_api_key or "", expected):
+        raise HTTPException(status_code=401, detail="Invalid or missing API key")
+
+
+app = FastAPI(title="TaxEase API", lifespan=lifespan, dependencies=[Depends(check_api_key)])
+
+
+class Profile(BaseModel):
+    """Answers to the relief form of Main.py; a question left blank matches every option"""
+    citizenship: Optional[str] = None
+    gender: Optional[str] = None
+    maritial_status: Optional[str] = None
+    employment: Optional[str] = None
+    children: Optional[str] = None
+
+
+class Message(BaseModel):
+    role: str
+    content: str
+
+
+class ChatRequest(BaseModel):
+    prompt: str
+    # The conversation so far, including the system message and the prompt, as sent by Main.py
+    messages: List[Message] = []
+    # Profile text returned by /reliefs, scopes the cached answers
+    profile: Optional[str] = None
+    # Reliefs returned by /reliefs; if given, only their chunks are searched
+    eligible_reliefs: Optional[List[str]] = None
+    stream: bool = False
+
+
+class Expense(BaseModel):
+    # Named like the columns of the expenses table in Main.py
+    Category: Optional[str] = None
+    Amount: Optional[float] = None
+    Description: Optional[str] = None
+
+
+class Property(BaseModel):
+    rental_income: float = 0.0
+    is_co_owned: bool = False
+    ownership_share: float = 0.0
+    expenses: List[Expense] = []
+
+
+class RentalRequest(BaseModel):
+    properties: List[Property] = Field(min_length=1)
+    stream: bool = False
+
+
+def sse_events(chunks: Iterator[str]) -> Iterator[str]:
+    """
+    Frame streamed text as server-sent events: a "message" event per chunk with data {"text": ...},
+    then a "done" event, or an "error" event with data {"detail": ...} if generation fails midway.
+    """
+    try:
+        for chunk in chunks:
+            yield f"data: {json.dumps({'text': chunk})}\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+        return
+    yield "event: done\ndata: {}\n\n"
+
+
+def event_stream(chunks: Iterator[str]) -> StreamingResponse:
+    # The synchronous generator is advanced in the thread pool, one chunk at a time
+    return StreamingResponse(sse_events(chunks), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/health")
+async def health():
+    return {
+        "relief_vector_store": is_vector_store_loaded(RELIEF_COLLECTION),
+        "rental": rental_resources_health(),
+        # Hits, misses and time saved by the answer cache of this worker
+        "semantic_cache": semantic_cache.stats(),
+        "stub_models": STUB_MODELS,
+        # Process id of the worker that answered, to tell the workers apart
+        "worker": os.getpid(),
+    }
+
+
+@app.post("/reliefs")
+def reliefs(profile: Profile):
+    # A plain def so FastAPI runs it in its thread pool: get_relief_table may re-read the relief CSV
+    fields = profile.model_dump()
+    return {
+        "eligible_reliefs": get_eligible_reliefs(**fields),
+        "response": filter_and_get_reliefs(**fields),
+        "profile": capture_and_store(**fields),
+    }
+
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    retrieval_filter = relief_filter(request.eligible_reliefs) if relief_tags_available() else None
+    # Cached per worker and re-read at most every FINGERPRINT_CHECK_INTERVAL seconds, off the event loop when it is
+    fingerprint = await run_in_threadpool(collection_fingerprint, RELIEF_COLLECTION)
+    # Retrieval runs before the call returns, also when streaming, so it is kept off the event loop
+    response = await run_in_threadpool(get_chatbot_response,
+                                       prompt=request.prompt,
+                                       retriever=get_retriever(),
+                                       messages=[message.model_dump() for message in request.messages],
+                                       profile=request.profile,
+                                       retrieval_filter=retrieval_filter,
+                                       fingerprint=fingerprint,
+                                       # Stub answers are not worth caching
+                                       use_cache=not STUB_MODELS,
+                                       stream=request.stream)
+    if request.stream:
+        return event_stream(response)
+    return {"response": response}
+
+
+@app.post("/rental/analysis")
+async def rental_analysis(request: RentalRequest):
+    properties = [property_from_record(prop.model_dump()) for prop in request.properties]
+    # The synchronous pipeline is used rather than arun_rental_analysis: the shared clients keep their
+    # async connections on the background loop of run_coroutine, not on the loop of this server
+    try:
+        result = await run_in_threadpool(run_rental_analysis, properties, request.stream)
+    except ValueError as e:
+        # Raised when the property data is too large to send to the model
+        raise HTTPException(status_code=422, detail=str(e))
+    if request.stream:
+        return event_stream(result)
+    return {"report": result}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the TaxEase API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="Worker processes, each with its own shared resources")
+    args = parser.parse_args()
+    uvicorn.run("api:app", host=args.host, port=args.port, workers=args.workers)
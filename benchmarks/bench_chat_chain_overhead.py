@@ -0,0 +1,63 @@
+# ================== Note =================
+# Benchmark for the per-turn overhead of get_chatbot_response in helper_functions/llm.py
+# Compares building a ChatOpenAI client and RetrievalQA chain on every turn (the previous behaviour)
+# against getting the shared chain from get_qa_chain, through get_chat_llm as get_chatbot_response does.
+# Only the time to get a chain ready is measured: answering a query costs the same either way, and no
+# request is sent, so no API key is needed. The gain from keeping the HTTP connection pool warm
+# comes on top of this in production.
+# It also checks that the chain registry stays bounded when a new retriever is built for every turn.
+# Run from the root folder: python -m benchmarks.bench_chat_chain_overhead
+# ================== ==== =================
+
+import os
+import timeit
+from typing import List
+
+# ChatOpenAI refuses to build without a key; it is never used to make a request here
+os.environ.setdefault("OPENAI_API_KEY", "sk-stub")
+
+from langchain.chains import RetrievalQA
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_openai import ChatOpenAI
+
+from helper_functions import llm as llm_module
+from helper_functions.llm import QA_CHAIN_CACHE_SIZE, get_qa_chain
+
+
+class StubRetriever(BaseRetriever):
+    """Returns the same five chunks for every query"""
+    documents: List[Document]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.documents
+
+
+def main(turns=200, repeat=5):
+    documents = [Document(page_content=f"Relief chunk {i} " * 50) for i in range(5)]
+    retriever = StubRetriever(documents=documents)
+
+    def per_turn_construction():
+        # What get_chatbot_response used to do on every message
+        RetrievalQA.from_chain_type(llm=ChatOpenAI(model="gpt-4o-mini"), retriever=retriever, chain_type="stuff")
+
+    def shared_chain():
+        get_qa_chain(retriever)
+
+    legacy = min(timeit.repeat(per_turn_construction, number=turns, repeat=repeat)) / turns
+    shared = min(timeit.repeat(shared_chain, number=turns, repeat=repeat)) / turns
+
+    print(f"per-turn construction : {legacy * 1e3:8.3f} ms per turn")
+    print(f"shared chain          : {shared * 1e3:8.3f} ms per turn")
+    print(f"overhead removed      : {(legacy - shared) * 1e3:8.3f} ms per turn")
+
+    # A retriever per turn, as a caller building one per request would
+    for _ in range(turns):
+        get_qa_chain(StubRetriever(documents=documents))
+    print(f"registered chains after {turns} retrievers: {len(llm_module._qa_chain_registry)} "
+          f"(QA_CHAIN_CACHE_SIZE={QA_CHAIN_CACHE_SIZE})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# ================== Note =================
+# Measures the effect of the context packer (helper_functions/context_packer.py) on a fixed query set.
+# For every query the chunks are retrieved once from the relief or rental collection, and the context
+# stuffed into the prompt is compared as retrieved (the previous behaviour) and as packed:
+# context tokens always, and with --llm also the prompt tokens reported by the API and the answer latency.
+# Retrieval embeds the queries, so the collections' embedding backend must be reachable.
+# Run from the root folder: python -m benchmarks.bench_context_packing [--llm]
+# ================== ==== =================
+
+import argparse
+import statistics
+import time
+
+from helper_functions.context_packer import pack_documents
+from helper_functions.hybrid_retriever import HybridRetriever
+from helper_functions.llm import count_tokens, get_chat_llm, get_encoding
+from helper_functions.vector_store import get_vector_store
+
+QUERIES = {
+    "various_tax_relief": [
+        "Am I eligible for NSman (Self) Relief?",
+        "How much is the Working Mother's Child Relief for my second child?",
+        "Can I claim Parent Relief if my mother does not live with me?",
+        "What is the cap on CPF Cash Top-up Relief?",
+        "Who can claim Spouse Relief after a divorce?",
+        "How is Course Fees Relief deferred?",
+        "What is the personal income tax relief cap?",
+        "Can both parents share the Qualifying Child Relief?",
+    ],
+    "rental_info": [
+        "What are the allowable expenses against rental income?",
+        "How does the simplified rental expense claim work?",
+        "Can I deduct mortgage interest on a co-owned property?",
+        "Are renovation costs deductible from rental income?",
+    ],
+}
+
+PROMPT = "Use the following context to answer the question.\n\n{context}\n\nQuestion: {question}"
+
+
+def context(documents):
+    return "\n\n".join(document.page_content for document in documents)
+
+
+def main(use_llm=False, k=5):
+    llm = get_chat_llm("gpt-4o-mini", temperature=0) if use_llm else None
+    results = {"retrieved": {"context": [], "prompt": [], "latency": []},
+               "packed": {"context": [], "prompt": [], "latency": []}}
+    pack_times = []
+    # Loaded up front, so the first query's packing time does not include reading the tokenizer
+    get_encoding()
+
+    for collection_name, queries in QUERIES.items():
+        retriever = HybridRetriever.from_vector_store(get_vector_store(collection_name), k=k)
+        for query in queries:
+            retrieved = retriever.invoke(query)
+            start = time.perf_counter()
+            packed = pack_documents(retrieved)
+            pack_times.append((time.perf_counter() - start) * 1000)
+
+            for name, documents in (("retrieved", retrieved), ("packed", packed)):
+                results[name]["context"].append(count_tokens(context(documents)))
+                if llm is not None:
+                    start = time.perf_counter()
+                    answer = llm.invoke(PROMPT.format(context=context(documents), question=query))
+                    results[name]["latency"].append(time.perf_counter() - start)
+                    results[name]["prompt"].append(answer.usage_metadata["input_tokens"])
+
+    print(f"Queries: {sum(len(queries) for queries in QUERIES.values())}, "
+          f"packing time: {statistics.mean(pack_times):.2f} ms per query")
+    print(f"{'context':>10} | {'context tokens':>14} | {'prompt tokens':>13} | {'latency (s)':>11}")
+    for name, result in results.items():
+        prompt = f"{statistics.mean(result['prompt']):.0f}" if result["prompt"] else "-"
+        latency = f"{statistics.mean(result['latency']):.2f}" if result["latency"] else "-"
+        print(f"{name:>10} | {statistics.mean(result['context']):>14.0f} | {prompt:>13} | {latency:>11}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm", action="store_true", help="also send every prompt to gpt-4o-mini to measure latency")
+    main(use_llm=parser.parse_args().llm)
@@ -0,0 +1,68 @@
+# ================== Note =================
+# Cold-start import time of the app, measured with python -X importtime in fresh interpreters.
+# "relief tab" is what Main.py imports before the first page is shown; "relief + rental" adds the
+# rental pipeline, which Main.py used to import at startup and now imports on the first report.
+# The slowest modules of each set are listed, to see where the time goes.
+# Run from the root folder: python -m benchmarks.bench_import_time
+# ================== ==== =================
+
+import statistics
+import subprocess
+import sys
+
+RELIEF_TAB = [
+    "helper_functions.vector_store",
+    "helper_functions.hybrid_retriever",
+    "logics.datafile",
+    "logics.relieftagging",
+    "helper_functions.llm",
+]
+
+IMPORT_SETS = {
+    "relief tab": RELIEF_TAB,
+    "relief + rental": RELIEF_TAB + ["logics.rentalcalculatorlangchain"],
+}
+
+
+# Main.py swaps in pysqlite3 before chromadb is imported
+SQLITE_SWAP = """
+try:
+    __import__('pysqlite3')
+    import sys
+    sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
+except ImportError:
+    pass
+"""
+
+
+def import_times(modules):
+    """
+    Import modules in a fresh interpreter.
+    Returns the total import time and the cumulative time of every top-level import, in µs.
+    """
+    code = SQLITE_SWAP + "\n".join(f"import {module}" for module in modules)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True, check=True)
+    top_level = {}
+    for line in result.stderr.splitlines():
+        # "import time: <self µs> | <cumulative µs> | <package>", nested packages indented by two spaces per level
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, package = line[len("import time:"):].split("|")
+        if self_us.strip().isdigit() and not package.startswith("  "):
+            top_level[package.strip()] = int(cumulative_us)
+    return sum(top_level.values()), top_level
+
+
+def main(repeat=5, top=8):
+    for name, modules in IMPORT_SETS.items():
+        runs = [import_times(modules) for _ in range(repeat)]
+        totals = [total for total, _ in runs]
+        print(f"{name}: median {statistics.median(totals) / 1e6:.2f}s over {repeat} cold starts")
+        slowest = sorted(runs[-1][1].items(), key=lambda item: item[1], reverse=True)[:top]
+        for module, microseconds in slowest:
+            print(f"    {microseconds / 1e6:6.2f}s  {module}")
+
+
+if __name__ == "__main__":
+    main()
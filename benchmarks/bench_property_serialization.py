@@ -0,0 +1,52 @@
+# ================== Note =================
+# Compares the size of the property data sent to the tax specialist chain:
+# str(property_list) (the previous behaviour) against the compact serializer in logics/rentalserializer.py
+# Run from the root folder: python -m benchmarks.bench_property_serialization
+# ================== ==== =================
+
+import random
+import timeit
+
+import pandas as pd
+
+from helper_functions.llm import count_tokens
+from logics.rentalserializer import serialize_properties, chunk_properties
+
+CATEGORIES = ["Propety Tax", "Mortgage Loan Interest", "Fire Insurance", "Maintenance Fee", "Repairs", "Agent Commission", "Others"]
+
+
+def sample_portfolio(num_properties, expenses_per_property, seed=0):
+    """A portfolio shaped like st.session_state.properties"""
+    rng = random.Random(seed)
+    portfolio = []
+    for _ in range(num_properties):
+        co_owned = rng.random() < 0.5
+        portfolio.append({
+            "rental_income": float(rng.randrange(12000, 96000, 100)),
+            "is_co_owned": co_owned,
+            "ownership_share": float(rng.choice([20, 25, 50])) if co_owned else 0.0,
+            "expenses": pd.DataFrame({
+                "Category": [rng.choice(CATEGORIES) for _ in range(expenses_per_property)],
+                "Amount": [float(rng.randrange(50, 12000, 10)) for _ in range(expenses_per_property)],
+                "Description": [rng.choice(["", "aircon servicing", "replace water heater", "annual premium"])
+                                for _ in range(expenses_per_property)],
+            }),
+        })
+    return portfolio
+
+
+def main():
+    print(f"{'portfolio':>24} | {'str() tokens':>12} | {'compact tokens':>14} | {'saved':>6} | {'parts':>5} | {'build (ms)':>10}")
+    for num_properties, expenses in [(1, 3), (3, 5), (10, 10), (10, 80), (50, 40)]:
+        portfolio = sample_portfolio(num_properties, expenses)
+        before = count_tokens(str(portfolio))
+        after = count_tokens(serialize_properties(portfolio))
+        parts = len(chunk_properties(portfolio))
+        build = min(timeit.repeat(lambda: serialize_properties(portfolio), number=10, repeat=3)) / 10
+        label = f"{num_properties} props x {expenses} expenses"
+        print(f"{label:>24} | {before:>12} | {after:>14} | {1 - after / before:>6.0%} | {parts:>5} | {build * 1e3:>10.2f}")
+    print("Note: str() output of tables longer than 60 rows is truncated by pandas, so its count understates the full data.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# ================== Note =================
+# Micro-benchmark for the relief eligibility lookup in logics/datafile.py
+# Compares the precomputed answers (see build_relief_lookup.py) against the chained pandas filters
+# Run from the root folder: python -m benchmarks.bench_relief_lookup
+# ================== ==== =================
+
+import timeit
+
+from logics.datafile import (get_eligible_reliefs, get_eligible_reliefs_pandas, get_relief_table, profile_columns,
+                             profile_keys)
+
+
+def all_profiles(df):
+    """Every combination of answers the form accepts, including questions left blank (None)"""
+    return [dict(zip(profile_columns, key)) for key in profile_keys(df)]
+
+
+def main(repeat=5):
+    relief_df = get_relief_table().df
+    profiles = all_profiles(relief_df)
+
+    # Both paths must agree on every profile before timing them
+    for profile in profiles:
+        expected = get_eligible_reliefs_pandas(relief_df, **profile)
+        actual = get_eligible_reliefs(**profile)
+        assert expected == actual, f"Mismatch for {profile}: {expected} != {actual}"
+
+    def run_pandas():
+        for profile in profiles:
+            get_eligible_reliefs_pandas(relief_df, **profile)
+
+    def run_index():
+        for profile in profiles:
+            get_eligible_reliefs(**profile)
+
+    pandas_time = min(timeit.repeat(run_pandas, number=1, repeat=repeat)) / len(profiles)
+    index_time = min(timeit.repeat(run_index, number=100, repeat=repeat)) / (100 * len(profiles))
+
+    print(f"Profiles checked: {len(profiles)} (all consistent)")
+    print(f"pandas filter : {pandas_time * 1e6:10.1f} µs per lookup")
+    print(f"lookup table  : {index_time * 1e6:10.1f} µs per lookup")
+    print(f"speed-up      : {pandas_time / index_time:10.0f}x")
+
+
+if __name__ == "__main__":
+    main()
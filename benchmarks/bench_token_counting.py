@@ -0,0 +1,59 @@
+# ================== Note =================
+# Micro-benchmark for the token counting helpers in helper_functions/llm.py
+# Compares looking up the encoder on every call and joining message contents (the previous behaviour)
+# against the cached encoder, count_tokens_batch and the per-message count cache.
+# Texts are chunks of data/type_of_reliefs.txt, the messages a 20-turn conversation recounted every turn.
+# Run from the root folder: python -m benchmarks.bench_token_counting
+# ================== ==== =================
+
+import timeit
+
+import tiktoken
+
+from helper_functions.llm import count_tokens, count_tokens_batch, count_tokens_from_message
+
+
+def legacy_count_tokens(text):
+    encoding = tiktoken.encoding_for_model('gpt-4o-mini')
+    return len(encoding.encode(text))
+
+
+def legacy_count_tokens_from_message(messages):
+    encoding = tiktoken.encoding_for_model('gpt-4o-mini')
+    value = ' '.join([x.get('content') for x in messages])
+    return len(encoding.encode(value))
+
+
+def report(name, seconds, counts):
+    print(f"{name:<40} {counts / seconds:>12,.0f} counts/s")
+
+
+def main(repeat=5):
+    with open("./data/type_of_reliefs.txt", encoding="utf-8") as f:
+        text = f.read()
+    texts = [text[i:i + 1000] for i in range(0, len(text), 900)]
+    messages = [{"role": "user" if i % 2 else "assistant", "content": texts[i % len(texts)]} for i in range(20)]
+
+    assert [legacy_count_tokens(t) for t in texts] == count_tokens_batch(texts)
+
+    def best(fn, number):
+        return min(timeit.repeat(fn, number=number, repeat=repeat))
+
+    print(f"Texts: {len(texts)} chunks of up to 1000 characters")
+    report("count_tokens, encoder looked up per call",
+           best(lambda: [legacy_count_tokens(t) for t in texts], 10), 10 * len(texts))
+    report("count_tokens, cached encoder",
+           best(lambda: [count_tokens(t) for t in texts], 10), 10 * len(texts))
+    report("count_tokens_batch",
+           best(lambda: count_tokens_batch(texts), 10), 10 * len(texts))
+
+    # The history window counts every message of the conversation once per turn
+    print(f"Messages: {len(messages)}, counted one by one as by build_history_window")
+    report("count_tokens_from_message, uncached",
+           best(lambda: [legacy_count_tokens_from_message([m]) for m in messages], 50), 50 * len(messages))
+    report("count_tokens_from_message, cached",
+           best(lambda: [count_tokens_from_message([m]) for m in messages], 50), 50 * len(messages))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# ================== Note =================
+# Checks that OnnxEmbeddings (helper_functions/onnx_embeddings.py) gives the same vectors as the
+# sentence-transformers model the ONNX file was exported from.
+# The reference vectors are computed once with sentence-transformers and saved next to the model files;
+# sentence-transformers is not a dependency of the app, so that step can run in another environment:
+#   python -m benchmarks.check_onnx_embeddings --save-reference PATH_TO_SENTENCE_TRANSFORMERS_MODEL
+# The check itself only needs the app's dependencies:
+#   python -m benchmarks.check_onnx_embeddings
+# The texts cover a short query, relief and rental passages, and a text longer than ONNX_MAX_LENGTH tokens,
+# embedded together so batching, padding and truncation are all exercised.
+# Run from the root folder, with ONNX_EMBEDDING_MODEL and ONNX_MODEL_DIRECTORY set as for the app.
+# ================== ==== =================
+
+import argparse
+import os
+
+import numpy as np
+
+ONNX_EMBEDDING_MODEL = os.getenv("ONNX_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+ONNX_MODEL_DIRECTORY = os.getenv("ONNX_MODEL_DIRECTORY", "./models")
+
+TEXTS = [
+    "Am I eligible for NSman relief?",
+    "Working Mother's Child Relief for my second child",
+    "You can claim Parent Relief if you supported a parent living in Singapore who did not have an annual "
+    "income of more than $4,000 in the previous year.",
+    "Rental expenses such as mortgage interest, property tax, fire insurance and repairs are deductible "
+    "against the gross rent, while renovation costs and the initial cost of furniture are not.",
+    "Course Fees Relief " * 150,
+]
+# Largest difference allowed between a component of the two vectors
+TOLERANCE = 1e-4
+
+
+def reference_path(model: str = ONNX_EMBEDDING_MODEL, directory: str = ONNX_MODEL_DIRECTORY) -> str:
+    return os.path.join(directory, model.replace("/", "__"), "reference_embeddings.npy")
+
+
+def save_reference(source_model: str) -> None:
+    from sentence_transformers import SentenceTransformer
+
+    vectors = SentenceTransformer(source_model, device="cpu").encode(TEXTS, normalize_embeddings=True)
+    path = reference_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.save(path, vectors)
+    print(f"Saved {vectors.shape[0]} reference vectors of {vectors.shape[1]} dimensions to {path}")
+
+
+def check(batch_size: int) -> bool:
+    from helper_functions.onnx_embeddings import OnnxEmbeddings
+
+    reference = np.load(reference_path())
+    embeddings = OnnxEmbeddings(batch_size=batch_size)
+    vectors = np.array(embeddings.embed_documents(TEXTS))
+    query_vector = np.array(embeddings.embed_query(TEXTS[0]))
+
+    difference = np.abs(vectors - reference).max(axis=1)
+    cosine = (vectors * reference).sum(axis=1)
+    for text, text_difference, text_cosine in zip(TEXTS, difference, cosine):
+        print(f"{text[:40]!r:44} max difference {text_difference:.2e}  cosine {text_cosine:.6f}")
+    query_difference = np.abs(query_vector - reference[0]).max()
+    print(f"{'embed_query':44} max difference {query_difference:.2e}")
+
+    passed = difference.max() <= TOLERANCE and query_difference <= TOLERANCE
+    print(f"{'PASS' if passed else 'FAIL'} (tolerance {TOLERANCE:.0e}, batch size {batch_size})")
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--save-reference", metavar="SOURCE_MODEL",
+                        help="compute the reference vectors with this sentence-transformers model instead of checking")
+    parser.add_argument("--batch-size", type=int, default=2,
+                        help="small enough by default to split the texts into several batches")
+    args = parser.parse_args()
+    if args.save_reference:
+        save_reference(args.save_reference)
+    else:
+        raise SystemExit(0 if check(args.batch_size) else 1)
@@ -0,0 +1,71 @@
+# ================== Note =================
+# Offline evaluation of retrieval over the tax relief collection: vector search, BM25 and the hybrid of both
+# (helper_functions/hybrid_retriever.py), on the hand-labelled queries of benchmarks/retrieval_queries.json.
+# Each query is phrased the way a user would ask it, and lists the chunks that answer it, picked by reading
+# the chunks of the collection; the excerpts are only there to review the labels.
+# Reports recall@k (share of the relevant chunks retrieved, out of at most k), MRR (reciprocal rank of the
+# first relevant chunk) and latency per query.
+# Vector search embeds the queries with the collection's backend, so OpenAI collections need an API key;
+# without one the vector and hybrid rows are reported as not measured.
+# Run from the root folder: python -m benchmarks.eval_hybrid_retrieval
+# ================== ==== =================
+
+import json
+import statistics
+import time
+
+from langchain_core.documents import Document
+
+from helper_functions.hybrid_retriever import HybridRetriever
+from helper_functions.ingestion import chunk_id
+from helper_functions.vector_store import get_vector_store
+
+
+def load_cases(path="./benchmarks/retrieval_queries.json"):
+    with open(path, encoding="utf-8") as f:
+        return [(case["query"], [chunk["chunk_id"] for chunk in case["relevant"]]) for case in json.load(f)]
+
+
+def main(k=5):
+    vector_store = get_vector_store("various_tax_relief")
+    retriever = HybridRetriever.from_vector_store(vector_store, k=k, mode="hybrid")
+
+    methods = {
+        "vector": lambda query: vector_store.similarity_search(query, k=k),
+        "bm25": lambda query: retriever.lexical_search(query)[:k],
+        "hybrid": retriever.invoke,
+    }
+
+    cases = load_cases()
+    # Chunks are compared by content (see chunk_id), as older collections have random ids
+    index = retriever.bm25_index
+    stored = {
+        chunk_id(Document(page_content=text, metadata=metadata)) for text, metadata in zip(index.texts, index.metadatas)
+    }
+    missing = [query for query, relevant in cases if not set(relevant) <= stored]
+    if missing:
+        print(f"Labels of {len(missing)} queries name chunks that are not in the collection, relabel them: {missing}")
+
+    print(f"Queries: {len(cases)}, relevant chunks per query: {statistics.mean(len(r) for _, r in cases):.1f}")
+    print(f"{'method':>8} | {'recall@' + str(k):>9} | {'MRR':>5} | {'p50 (ms)':>8} | {'p95 (ms)':>8}")
+
+    for name, search in methods.items():
+        recalls, reciprocal_ranks, latencies = [], [], []
+        try:
+            for query, relevant in cases:
+                start = time.perf_counter()
+                documents = search(query)
+                latencies.append((time.perf_counter() - start) * 1000)
+                ranked = [chunk_id(document) for document in documents]
+                recalls.append(len(set(ranked) & set(relevant)) / min(len(relevant), k))
+                reciprocal_ranks.append(next((1 / rank for rank, key in enumerate(ranked, start=1) if key in relevant), 0.0))
+        except Exception as e:
+            print(f"{name:>8} | not measured: {type(e).__name__}: {e}")
+            continue
+        p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+        print(f"{name:>8} | {statistics.mean(recalls):>9.3f} | {statistics.mean(reciprocal_ranks):>5.3f} | "
+              f"{statistics.median(latencies):>8.1f} | {p95:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# ================== Note =================
+# Load test of the HTTP service in api.py against the stub LLM and embeddings (helper_functions/stub_models.py).
+# The service is started with TAXEASE_STUB_MODELS=1 and --workers worker processes, unless --url points at
+# one already running. --concurrency clients then send --requests requests to each endpoint, and the
+# throughput and latency percentiles are reported, with the time to the first token for the streamed chat.
+# The stub answers after STUB_FIRST_TOKEN_LATENCY seconds and streams STUB_ANSWER_TOKENS tokens, so the
+# numbers measure the overhead and concurrency of the service rather than the model.
+# Run from the root folder: python -m benchmarks.load_test_api --workers 4 --concurrency 50
+# ================== ==== =================
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv('.env')
+
+PROFILES = [
+    {"citizenship": "Singaporean", "gender": "Female", "maritial_status": "Married", "employment": None, "children": "Yes"},
+    {"citizenship": "Permanent Resident", "gender": "Male", "maritial_status": "Single", "employment": None, "children": "No"},
+    {"citizenship": "Foreigner", "gender": None, "maritial_status": None, "employment": None, "children": None},
+]
+
+QUESTIONS = [
+    "Am I eligible for NSman (Self) Relief?",
+    "How much is the Working Mother's Child Relief for my second child?",
+    "Can I claim Parent Relief if my mother does not live with me?",
+    "What is the cap on CPF Cash Top-up Relief?",
+]
+
+PROPERTY = {
+    "rental_income": 36000, "is_co_owned": True, "ownership_share": 50,
+    "expenses": [{"Category": "Mortgage Loan Interest", "Amount": 8000, "Description": ""},
+                 {"Category": "Propety Tax", "Amount": 1200, "Description": ""}],
+}
+
+
+def start_service(port, workers, timeout=180):
+    """Start api.py with the stub models and wait until every worker answers /health"""
+    env = dict(os.environ, TAXEASE_STUB_MODELS="1")
+    process = subprocess.Popen([sys.executable, "api.py", "--port", str(port), "--workers", str(workers)], env=env)
+    # A worker only accepts connections once its lifespan has loaded the shared resources, so the test
+    # starts when /health has been answered by as many distinct workers as were started
+    ready = set()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"api.py exited with code {process.returncode}")
+        try:
+            response = httpx.get(f"http://127.0.0.1:{port}/health", headers=auth_headers())
+            if response.status_code == 200:
+                # Guards against load testing another service already listening on the port with the real models
+                if not response.json()["stub_models"]:
+                    process.terminate()
+                    raise RuntimeError(f"the service on port {port} does not use the stub models")
+                ready.add(response.json()["worker"])
+                if len(ready) >= workers:
+                    return process
+                continue
+        except httpx.TransportError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("api.py did not start in time")
+
+
+def auth_headers():
+    api_key = os.getenv("TAXEASE_API_KEY")
+    return {"X-API-Key": api_key} if api_key else {}
+
+
+async def post_json(client, path, payload):
+    response = await client.post(path, json=payload)
+    response.raise_for_status()
+    return None
+
+
+async def post_stream(client, path, payload):
+    """Send a streaming request and return the seconds until its first event"""
+    start = time.perf_counter()
+    first_event = None
+    async with client.stream("POST", path, json=payload) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith("event: error"):
+                raise RuntimeError("the service reported an error while streaming")
+            if line.startswith("data:") and first_event is None:
+                first_event = time.perf_counter() - start
+    return first_event
+
+
+async def run_scenario(client, send, total, concurrency):
+    """Send total requests with at most concurrency in flight; send(i) returns the time to first token or None"""
+    latencies, first_tokens, failures = [], [], 0
+    next_request = iter(range(total))
+
+    async def worker():
+        nonlocal failures
+        for i in next_request:
+            start = time.perf_counter()
+            try:
+                first_token = await send(i)
+            except (httpx.HTTPError, RuntimeError):
+                failures += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            if first_token is not None:
+                first_tokens.append(first_token)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return time.perf_counter() - start, latencies, first_tokens, failures
+
+
+def percentiles(values):
+    if len(values) < 2:
+        return values * 2 if values else [float("nan")] * 2
+    cuts = statistics.quantiles(values, n=100)
+    return [cuts[49], cuts[94]]
+
+
+async def load_test(url, requests, concurrency, rental_requests):
+    scenarios = {
+        "reliefs": (lambda client, i: post_json(client, "/reliefs", PROFILES[i % len(PROFILES)]), requests),
+        "chat (streamed)": (lambda client, i: post_stream(client, "/chat", {
+            "prompt": QUESTIONS[i % len(QUESTIONS)],
+            "messages": [{"role": "user", "content": QUESTIONS[i % len(QUESTIONS)]}],
+            "eligible_reliefs": None,
+            "stream": True,
+        }), requests),
+        "rental analysis": (lambda client, i: post_json(client, "/rental/analysis", {"properties": [PROPERTY]}),
+                            rental_requests),
+    }
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    print(f"{'endpoint':<18} | {'requests':>8} | {'failed':>6} | {'req/s':>7} | "
+          f"{'p50 (s)':>7} | {'p95 (s)':>7} | {'TTFT p50/p95 (s)':>16}")
+    for name, (send, total) in scenarios.items():
+        # A new client per scenario: connections left idle by the previous one can be closed by the server's
+        # keep-alive timeout just as they are reused, which fails the request without it reaching the service
+        async with httpx.AsyncClient(base_url=url, headers=auth_headers(), timeout=600, limits=limits) as client:
+            elapsed, latencies, first_tokens, failures = await run_scenario(
+                client, lambda i: send(client, i), total, concurrency)
+            p50, p95 = percentiles(latencies)
+            ttft = "-"
+            if first_tokens:
+                ttft_p50, ttft_p95 = percentiles(first_tokens)
+                ttft = f"{ttft_p50:.2f} / {ttft_p95:.2f}"
+            print(f"{name:<18} | {total:>8} | {failures:>6} | {len(latencies) / elapsed:>7.1f} | "
+                  f"{p50:>7.2f} | {p95:>7.2f} | {ttft:>16}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="test a running service instead of starting one with the stub models")
+    parser.add_argument("--workers", type=int, default=2, help="worker processes of the started service")
+    parser.add_argument("--port", type=int, default=8765, help="port of the started service")
+    parser.add_argument("--concurrency", type=int, default=20, help="requests in flight at once")
+    parser.add_argument("--requests", type=int, default=200, help="requests sent to /reliefs and /chat")
+    parser.add_argument("--rental-requests", type=int, default=20, help="requests sent to /rental/analysis")
+    args = parser.parse_args()
+
+    process = None if args.url else start_service(args.port, args.workers)
+    url = args.url or f"http://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(load_test(url, args.requests, args.concurrency, args.rental_requests))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
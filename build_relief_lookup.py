@@ -0,0 +1,68 @@
+# ================== Note =================
+# Precomputes the answer of the relief form for every profile it can submit, including questions left blank:
+# the eligible reliefs and the reply of filter_and_get_reliefs, written to data/relief_lookup.json together
+# with the SHA-256 of data/relief_table.csv. logics/datafile.py loads it at startup if it matches the CSV.
+# Run again whenever relief_table.csv changes: python build_relief_lookup.py
+# Check the artifact against the pandas filter for every profile: python build_relief_lookup.py --check
+# ================== ==== =================
+
+import argparse
+import io
+import json
+import os
+import sys
+from logics.datafile import (filepath, lookup_path, profile_columns, load_data, profile_keys, compute_relief_lookup,
+                             csv_digest, dump_relief_lookup, read_relief_lookup, get_eligible_reliefs_pandas,
+                             render_relief_response)
+
+
+def read_relief_table():
+    """Return the relief table and the digest of its file"""
+    with open(filepath, "rb") as f:
+        data = f.read()
+    return load_data(io.BytesIO(data)), csv_digest(data)
+
+
+def build():
+    df, digest = read_relief_table()
+    lookup = compute_relief_lookup(df)
+    artifact = dump_relief_lookup(lookup, digest)
+    # Written to a temporary file first, so a running app never reads a partial artifact
+    with open(lookup_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(artifact, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(lookup_path + ".tmp", lookup_path)
+    print(f"Wrote {len(artifact['profiles'])} profiles with {len(artifact['answers'])} distinct answers to {lookup_path}")
+
+
+def check():
+    """Compare the artifact with the pandas filter for every profile; returns True if they all agree"""
+    df, digest = read_relief_table()
+    lookup = read_relief_lookup(lookup_path, digest)
+    if lookup is None:
+        print(f"{lookup_path} is missing or was built from another version of {filepath}, "
+              f"run python build_relief_lookup.py")
+        return False
+
+    keys = profile_keys(df)
+    if set(lookup) != set(keys):
+        print(f"{lookup_path} covers {len(lookup)} profiles, expected {len(keys)}")
+        return False
+
+    mismatches = 0
+    for key in keys:
+        reliefs = get_eligible_reliefs_pandas(df, **dict(zip(profile_columns, key)))
+        expected = (None if reliefs is None else tuple(reliefs), render_relief_response(reliefs))
+        if tuple(lookup[key]) != expected:
+            mismatches += 1
+            print(f"Mismatch for {dict(zip(profile_columns, key))}: {lookup[key].reliefs} != {expected[0]}")
+    print(f"Profiles checked: {len(keys)}, mismatches: {mismatches}")
+    return mismatches == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the relief form answers for every profile")
+    parser.add_argument("--check", action="store_true", help="check the artifact against the pandas filter instead")
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(0 if check() else 1)
+    build()
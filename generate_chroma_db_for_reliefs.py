@@ -1,13 +1,17 @@
 import streamlit as st
 from langchain.docstore.document import Document
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.document_loaders import BaseLoader
 from langchain_core.documents import Document
+from helper_functions.vector_store import DEFAULT_EMBEDDING_BACKEND, get_embeddings
+from helper_functions.ingestion import sync_collection, split_documents
+from logics.relieftagging import tag_relief_chunks
 # ================== Note =================
 # This script is meant to set up the vector store for info retrieval
 # This script need not be re-run everytime the app starts
+# The embedding backend is chosen with the EMBEDDING_BACKEND environment variable: "openai" (default)
+# or "onnx" for a local CPU model, e.g. EMBEDDING_BACKEND=onnx streamlit run <this script>.
+# The app embeds queries with whichever backend the collection was built with.
 # ================== ==== =================
 
 
@@ -42,7 +46,7 @@ class CustomTextLoader(BaseLoader):
     def load(self):
         with open(self.file_path, 'r', encoding=self.encoding) as f:
             text = f.read()
-        return [Document(page_content=text)]
+        return [Document(page_content=text, metadata={"source": self.file_path})]
 
 # Usage
 loader = CustomTextLoader("./data/type_of_reliefs.txt")
@@ -56,17 +60,24 @@ text_splitter_ = RecursiveCharacterTextSplitter(
     chunk_overlap=100,
 )
 
-splitted_documents = text_splitter_.split_text(documents[0].page_content)
-splitted_document_objs = [Document(page_content=text) for text in splitted_documents]
+# Split all documents; each chunk keeps its source in the metadata
+splitted_document_objs = split_documents(documents, text_splitter_)
+# Tag each chunk with the reliefs whose section it belongs to, so the chat can search only the eligible reliefs
+tag_relief_chunks(documents, splitted_document_objs)
 
 # Embedding & vector stores
-embeddings_model = OpenAIEmbeddings(model='text-embedding-3-small')
-vector_store = Chroma.from_documents(
+# With OpenAI, chunks embedded in an earlier run are read from the embedding cache instead of calling the API
+embedding_backend = DEFAULT_EMBEDDING_BACKEND
+embeddings_model = get_embeddings(embedding_backend)
+# Only new or changed chunks are embedded and added; chunks no longer produced are deleted
+vector_store, sync_stats = sync_collection(
     collection_name="various_tax_relief",
     documents=splitted_document_objs,
     embedding=embeddings_model,
     persist_directory="./chroma_langchain_db",
+    embedding_backend=embedding_backend,
 )
+st.write("Collection updated:", sync_stats)
 
 # Verify the vector store is populated by performing a search
 query = "What are the eligible tax reliefs for NSman?"
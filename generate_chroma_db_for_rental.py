@@ -1,13 +1,14 @@
 import streamlit as st
-from langchain.docstore.document import Document
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.document_loaders import BaseLoader
-from langchain_core.documents import Document
+from helper_functions.vector_store import DEFAULT_EMBEDDING_BACKEND, get_embeddings
+from helper_functions.ingestion import sync_collection, load_pdf_pages, split_documents
 # ================== Note =================
 # This script Is meant to set up the vector store for info retrieval
 # This script need not be re-run everytime the app starts
+# The embedding backend is chosen with the EMBEDDING_BACKEND environment variable: "openai" (default)
+# or "onnx" for a local CPU model, e.g. EMBEDDING_BACKEND=onnx streamlit run <this script>.
+# The app embeds queries with whichever backend the collection was built with.
 # ================== ==== =================
 
 
@@ -15,6 +16,7 @@ from langchain_core.documents import Document
 
 # Import relevant packages
 import os
+import time
 from dotenv import load_dotenv
 from openai import OpenAI
 
@@ -32,14 +34,6 @@ client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
 # # 1. Document loading
 from langchain.document_loaders import Docx2txtLoader
-from langchain.document_loaders import PyPDFLoader
-
-# Usage:
-
-# A. Load the word document on Income_from_property_rented_out.docx
-loader = Docx2txtLoader("./data/Income_from_property_rented_out.docx")
-documents = loader.load()
-
 
 # Splitting & chunking
 text_splitter_ = RecursiveCharacterTextSplitter(
@@ -48,41 +42,42 @@ text_splitter_ = RecursiveCharacterTextSplitter(
     chunk_overlap=100,
 )
 
-splitted_documents = text_splitter_.split_text(documents[0].page_content)
-splitted_document_objs = [Document(page_content=text) for text in splitted_documents]
-
-# Embedding & vector stores
-embeddings_model = OpenAIEmbeddings(model='text-embedding-3-small')
-vector_store = Chroma.from_documents(
-    collection_name="rental_info",
-    documents=splitted_document_objs,
-    embedding=embeddings_model,
-    persist_directory="./chroma_langchain_db",
-)
+# Usage:
 
-# B Load the pdf document e_tax_guide_simplified_rental_expense_claim.pdf
-loader = PyPDFLoader("./data/e_tax_guide_simplifed_rental_expense_cLaim.pdf")
+# A. Load the word document on Income_from_property_rented_out.docx
+loader = Docx2txtLoader("./data/Income_from_property_rented_out.docx")
 documents = loader.load()
 
+# B Load every page of the pdf document e_tax_guide_simplified_rental_expense_claim.pdf, in parallel
+start = time.perf_counter()
+pdf_pages = load_pdf_pages("./data/e_tax_guide_simplifed_rental_expense_cLaim.pdf")
+documents += pdf_pages
+load_seconds = time.perf_counter() - start
 
-# Splitting & chunking
-text_splitter_ = RecursiveCharacterTextSplitter(
-    separators=["\n\n", "\n", " ", ""],
-    chunk_size=1000,
-    chunk_overlap=100,
-)
+# Split all documents; each chunk keeps its source and page number in the metadata
+start = time.perf_counter()
+splitted_document_objs = split_documents(documents, text_splitter_)
+split_seconds = time.perf_counter() - start
 
-splitted_documents = text_splitter_.split_text(documents[0].page_content)
-splitted_document_objs = [Document(page_content=text) for text in splitted_documents]
+st.write(f"Extracted {len(pdf_pages)} pdf pages in {load_seconds:.2f}s "
+         f"({len(pdf_pages) / max(load_seconds, 1e-9):.1f} pages/s)")
+st.write(f"Produced {len(splitted_document_objs)} chunks in {split_seconds:.2f}s "
+         f"({len(splitted_document_objs) / max(split_seconds, 1e-9):.1f} chunks/s)")
 
 # Embedding & vector stores
-embeddings_model = OpenAIEmbeddings(model='text-embedding-3-small')
-vector_store = Chroma.from_documents(
+# With OpenAI, chunks embedded in an earlier run are read from the embedding cache instead of calling the API
+embedding_backend = DEFAULT_EMBEDDING_BACKEND
+embeddings_model = get_embeddings(embedding_backend)
+# Both documents are synced in one go, so the chunks of one are not deleted as stale by the other.
+# Only new or changed chunks are embedded and added; chunks no longer produced are deleted
+vector_store, sync_stats = sync_collection(
     collection_name="rental_info",
     documents=splitted_document_objs,
     embedding=embeddings_model,
     persist_directory="./chroma_langchain_db",
+    embedding_backend=embedding_backend,
 )
+st.write("Collection updated:", sync_stats)
 
 
 
@@ -0,0 +1,88 @@
+# Client of the TaxEase HTTP service (api.py), used by Main.py when TAXEASE_API_URL is set.
+# The calls mirror the local functions Main.py uses otherwise; streamed answers are read from the
+# server-sent events of the service and yielded as text, so they can be passed to st.write_stream as before.
+import json
+import os
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional
+import requests
+
+API_TIMEOUT = float(os.getenv("TAXEASE_API_TIMEOUT", 300))  # seconds
+
+
+def api_url() -> Optional[str]:
+    """Base URL of the service, or None when the app runs the pipelines itself"""
+    return os.getenv("TAXEASE_API_URL")
+
+# One session per process, so Streamlit reruns keep the connections to the service open
+@lru_cache(maxsize=None)
+def get_session() -> requests.Session:
+    session = requests.Session()
+    api_key = os.getenv("TAXEASE_API_KEY")
+    if api_key:
+        session.headers["X-API-Key"] = api_key
+    return session
+
+
+def _post(path: str, payload: Dict, stream: bool = False) -> requests.Response:
+    response = get_session().post(api_url().rstrip("/") + path, json=payload, stream=stream, timeout=API_TIMEOUT)
+    if response.status_code == 422:
+        # Invalid input, e.g. property data too large to send to the model, raised as locally
+        detail = response.json().get("detail")
+        raise ValueError(detail if isinstance(detail, str) else json.dumps(detail))
+    response.raise_for_status()
+    return response
+
+
+def read_events(response: requests.Response) -> Iterator[str]:
+    """Yield the text of the server-sent events of a streamed response, see sse_events in api.py"""
+    event = "message"
+    with response:
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "done":
+                    return
+                if event == "error":
+                    raise RuntimeError(data["detail"])
+                yield data["text"]
+            elif not line:
+                event = "message"
+
+
+def get_reliefs(**profile) -> Dict:
+    """
+    Look up the reliefs of a profile, see /reliefs in api.py
+
+    Returns:
+        dict: "eligible_reliefs" (list or None), "response" (the reply of filter_and_get_reliefs)
+        and "profile" (the text of capture_and_store)
+    """
+    return _post("/reliefs", profile).json()
+
+
+def stream_chat(prompt: str, messages: List[Dict], profile: Optional[str] = None,
+                eligible_reliefs: Optional[List[str]] = None) -> Iterator[str]:
+    """Ask the chatbot, see get_chatbot_response; the request is sent before the first chunk is read"""
+    payload = {"prompt": prompt, "messages": messages, "profile": profile,
+               "eligible_reliefs": eligible_reliefs, "stream": True}
+    return read_events(_post("/chat", payload, stream=True))
+
+
+def property_record(property_info: Dict) -> Dict:
+    """Turn a property of st.session_state.properties into JSON, with missing expense cells as null"""
+    expenses = property_info["expenses"]
+    return {
+        "rental_income": property_info["rental_income"],
+        "is_co_owned": property_info["is_co_owned"],
+        "ownership_share": property_info["ownership_share"],
+        "expenses": expenses.astype(object).where(expenses.notna(), None).to_dict("records"),
+    }
+
+
+def stream_rental_analysis(property_list: List[Dict]) -> Iterator[str]:
+    """Generate the rental report, see run_rental_analysis; the request is sent before the first chunk is read"""
+    payload = {"properties": [property_record(property_info) for property_info in property_list], "stream": True}
+    return read_events(_post("/rental/analysis", payload, stream=True))
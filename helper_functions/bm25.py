@@ -0,0 +1,140 @@
+# BM25 inverted index over the chunks of a Chroma collection.
+# Embedding search on 1000-character chunks can rank poorly the chunk naming an exact relief title,
+# e.g. "Working Mother's Child Relief"; a lexical index finds such chunks reliably.
+# The index is built at ingestion time from the chunks stored in the collection (see sync_collection in
+# helper_functions/ingestion.py) and saved in the cache directory with the fingerprint of the
+# collection it was built from, so a stale index is detected and rebuilt.
+# It is kept out of the Chroma directory, which is tracked in git, as it is rewritten at runtime.
+import hashlib
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+from helper_functions.sqlite_cache import CACHE_DIRECTORY
+from helper_functions.vector_store import PERSIST_DIRECTORY, vector_store_fingerprint
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how i if in is it its my of on or s that the this to "
+    "was what when where which who will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric terms without stopwords; "Mother’s" and "Mother's" both give "mother" """
+    return [term for term in re.findall(r"[a-z0-9]+", text.lower()) if term not in _STOPWORDS]
+
+
+def bm25_index_path(collection_name: str, persist_directory: str) -> str:
+    """Path of a collection's index in CACHE_DIRECTORY; collections of other Chroma directories get other files"""
+    directory_key = hashlib.sha256(os.path.abspath(persist_directory).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(CACHE_DIRECTORY, "bm25", f"{collection_name}-{directory_key}.json")
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed set of chunks, with postings precomputed per term"""
+
+    def __init__(self, ids: List[str], texts: List[str], metadatas: List[Dict],
+                 fingerprint: Optional[str] = None, postings: Optional[Dict[str, List[List[int]]]] = None,
+                 doc_lengths: Optional[List[int]] = None):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.fingerprint = fingerprint
+
+        if postings is None or doc_lengths is None:
+            postings, doc_lengths = {}, []
+            for doc, text in enumerate(texts):
+                terms = tokenize(text)
+                doc_lengths.append(len(terms))
+                for term, frequency in Counter(terms).items():
+                    postings.setdefault(term, []).append([doc, frequency])
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+
+        # Everything that does not depend on the query is computed once
+        num_docs = len(texts)
+        average_length = sum(doc_lengths) / num_docs if num_docs else 0.0
+        self.idf = {
+            term: math.log(1 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in postings.items()
+        }
+        self.length_norm = [
+            BM25_K1 * (1 - BM25_B + BM25_B * length / average_length) if average_length else BM25_K1
+            for length in doc_lengths
+        ]
+
+    def search(self, query: str, k: int = 5, allowed: Optional[Set[int]] = None) -> List[Tuple[int, float]]:
+        """
+        Return the (position, score) of the k best-scoring chunks for the query, best first.
+        If allowed is given, only the chunks at those positions are considered.
+        """
+        scores = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc, frequency in self.postings[term]:
+                if allowed is not None and doc not in allowed:
+                    continue
+                scores[doc] = scores.get(doc, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + self.length_norm[doc])
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def save(self, path: str) -> None:
+        data = {
+            "fingerprint": self.fingerprint,
+            "ids": self.ids,
+            "texts": self.texts,
+            "metadatas": self.metadatas,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written to a temporary file first so a reader never sees a partial index
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(**data)
+
+
+def build_bm25_index(vector_store, fingerprint: Optional[str] = None) -> BM25Index:
+    """Index every chunk stored in a Chroma vector store's collection"""
+    contents = vector_store._collection.get(include=["documents", "metadatas"])
+    return BM25Index(
+        ids=contents["ids"],
+        texts=contents["documents"],
+        metadatas=[metadata or {} for metadata in contents["metadatas"]],
+        fingerprint=fingerprint or vector_store_fingerprint(vector_store),
+    )
+
+
+def load_bm25_index(vector_store, persist_directory: str = PERSIST_DIRECTORY) -> BM25Index:
+    """
+    Load the saved index of a vector store's collection. An index that is missing or was built from
+    other contents (e.g. the collection was rebuilt without re-running the ingestion) is rebuilt and saved.
+    """
+    path = bm25_index_path(vector_store._collection.name, persist_directory)
+    fingerprint = vector_store_fingerprint(vector_store)
+    try:
+        index = BM25Index.load(path)
+        if index.fingerprint == fingerprint:
+            return index
+    except (OSError, ValueError, TypeError):
+        pass
+
+    index = build_bm25_index(vector_store, fingerprint)
+    try:
+        index.save(path)
+    except OSError:
+        # A read-only deployment still works, it just rebuilds the index on every start
+        pass
+    return index
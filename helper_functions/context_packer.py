@@ -0,0 +1,101 @@
+# Packing of retrieved chunks into the context of the "stuff" chains.
+# The splitters cut documents into 1000-character chunks overlapping by 100 characters, so the k retrieved
+# chunks often repeat text, and nothing bounded the size of the context they were stuffed into.
+# The packer drops duplicate and contained chunks, merges chunks of the same source that overlap into one
+# passage, keeps the passages in order of relevance and stops once the token budget is used up.
+import os
+from typing import List
+from langchain.chains import RetrievalQA
+from langchain_core.callbacks import AsyncCallbackManagerForChainRun, CallbackManagerForChainRun
+from langchain_core.documents import Document
+from helper_functions.llm import count_tokens_batch, truncate_tokens
+
+# Large enough that the k=5 chunks of the chains are never truncated: packed, they measured 714 to 1339 tokens
+# on the relief queries of benchmarks/bench_context_packing.py, and the 5 largest chunks of the collections
+# add up to 1720. The budget only guards against larger k or chunks
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2000))
+# Longest overlap looked for between two chunks, comfortably above the splitters' chunk_overlap
+MAX_OVERLAP_CHARS = 200
+# Shorter overlaps are treated as coincidence rather than as neighbouring chunks
+MIN_OVERLAP_CHARS = 20
+# A passage that does not fit is still included, truncated, if at least this many tokens are left
+MIN_PASSAGE_TOKENS = 50
+
+
+def _overlap(first: str, second: str) -> int:
+    """Length of the longest end of first that second starts with, or 0"""
+    for length in range(min(len(first), len(second), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:length]):
+            return length
+    return 0
+
+
+def _merge_passages(passages: List[dict]) -> bool:
+    """Merge one pair of passages of the same source in place; returns False when no pair can be merged"""
+    for i, first in enumerate(passages):
+        for j, second in enumerate(passages):
+            if i == j or first["metadata"].get("source") != second["metadata"].get("source"):
+                continue
+            if second["text"] in first["text"]:
+                text = first["text"]
+            else:
+                overlap = _overlap(first["text"], second["text"])
+                if not overlap:
+                    continue
+                text = first["text"] + second["text"][overlap:]
+            # The merged passage is as relevant as the better of the two
+            first.update(text=text, rank=min(first["rank"], second["rank"]))
+            del passages[j]
+            return True
+    return False
+
+
+def pack_documents(documents: List[Document], token_budget: int = CONTEXT_TOKEN_BUDGET) -> List[Document]:
+    """
+    Turn retrieved chunks into the passages to stuff into a prompt.
+
+    Args:
+        documents: Retrieved chunks, most relevant first
+        token_budget: Maximum number of tokens of the passages, measured with count_tokens_batch
+
+    Returns:
+        list: Passages most relevant first, each keeping the metadata of its first chunk
+    """
+    passages, seen = [], set()
+    for rank, document in enumerate(documents):
+        if document.page_content not in seen:
+            seen.add(document.page_content)
+            passages.append({"rank": rank, "text": document.page_content, "metadata": document.metadata})
+
+    while _merge_passages(passages):
+        pass
+
+    passages.sort(key=lambda passage: passage["rank"])
+    passage_tokens = count_tokens_batch([passage["text"] for passage in passages])
+
+    packed, used = [], 0
+    for passage, tokens in zip(passages, passage_tokens):
+        # One more token for the separator between passages
+        tokens += 1
+        if used + tokens > token_budget:
+            remaining = token_budget - used - 1
+            if remaining >= MIN_PASSAGE_TOKENS:
+                packed.append(Document(page_content=truncate_tokens(passage["text"], remaining),
+                                       metadata=passage["metadata"]))
+            break
+        packed.append(Document(page_content=passage["text"], metadata=passage["metadata"]))
+        used += tokens
+    return packed
+
+
+class PackedRetrievalQA(RetrievalQA):
+    """RetrievalQA whose retrieved chunks are packed (see pack_documents) before being stuffed into the prompt"""
+
+    context_token_budget: int = CONTEXT_TOKEN_BUDGET
+
+    def _get_docs(self, question: str, *, run_manager: CallbackManagerForChainRun) -> List[Document]:
+        return pack_documents(super()._get_docs(question, run_manager=run_manager), self.context_token_budget)
+
+    async def _aget_docs(self, question: str, *, run_manager: AsyncCallbackManagerForChainRun) -> List[Document]:
+        documents = await super()._aget_docs(question, run_manager=run_manager)
+        return pack_documents(documents, self.context_token_budget)
@@ -0,0 +1,338 @@
+# Persistent store of the chat conversations, replacing st.session_state.messages.
+# Keeping every turn of every browser session in server memory grows without bound with the number of users.
+# The store keeps them in SQLite instead:
+# - Writes are queued and committed in batches by a background thread, so a chat turn never waits for the disk.
+# - Only the most recently used sessions are held in memory (LRU), and a cache miss reads the session back.
+# - Once a conversation grows past CONVERSATION_MAX_MESSAGES, its oldest messages are compacted into a
+#   compressed archive, so a session holds at most that many messages in memory. The chat only sends the
+#   newest turns to the LLM anyway (see build_history_window in helper_functions/llm.py).
+# - Sessions not updated for CONVERSATION_TTL are deleted with their messages and archives by the same background
+#   thread, since a session left by its user is never read again and the database would otherwise only grow.
+# Other backends can be plugged in by implementing ConversationStore, see get_conversation_store.
+import abc
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional
+from helper_functions.sqlite_cache import open_cache
+
+CONVERSATION_STORES = ("sqlite",)
+DEFAULT_CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "sqlite")
+
+# Sessions kept in memory
+CONVERSATION_CACHE_SESSIONS = int(os.getenv("CONVERSATION_CACHE_SESSIONS", 256))
+# A conversation longer than this is compacted down to its newest CONVERSATION_KEEP_MESSAGES messages
+CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", 40))
+CONVERSATION_KEEP_MESSAGES = int(os.getenv("CONVERSATION_KEEP_MESSAGES", 20))
+# Queued writes are committed at least this often (seconds), or as soon as this many are queued
+CONVERSATION_FLUSH_INTERVAL = float(os.getenv("CONVERSATION_FLUSH_INTERVAL", 1.0))
+CONVERSATION_FLUSH_BATCH = int(os.getenv("CONVERSATION_FLUSH_BATCH", 100))
+# Sessions are deleted this long after their last update (seconds, 0 keeps them forever),
+# checked at most every CONVERSATION_PURGE_INTERVAL seconds
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", 30 * 24 * 3600))
+CONVERSATION_PURGE_INTERVAL = float(os.getenv("CONVERSATION_PURGE_INTERVAL", 3600))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    profile TEXT,
+    eligible_reliefs TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (session_id, position)
+);
+CREATE TABLE IF NOT EXISTS archives (
+    session_id TEXT NOT NULL,
+    first_position INTEGER NOT NULL,
+    message_count INTEGER NOT NULL,
+    messages BLOB NOT NULL,
+    PRIMARY KEY (session_id, first_position)
+);
+"""
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+class Conversation(NamedTuple):
+    """A session as returned by ConversationStore.load"""
+    # The newest messages, oldest first, as {"role": ..., "content": ...} dicts shared with the store:
+    # they must not be modified, so token counts cached per message stay valid (see count_message_tokens)
+    messages: List[Dict[str, str]]
+    # Number of older messages compacted into the archive
+    archived: int
+    profile: Optional[str]
+    eligible_reliefs: Optional[List[str]]
+
+
+class ConversationStore(abc.ABC):
+    """Interface of the conversation stores; every method is safe to call from any thread"""
+
+    @abc.abstractmethod
+    def load(self, session_id: str) -> Conversation:
+        """Return the newest messages, the profile and the eligible reliefs of a session"""
+
+    @abc.abstractmethod
+    def append(self, session_id: str, role: str, content: str) -> None:
+        """Add a message at the end of a session"""
+
+    @abc.abstractmethod
+    def set_profile(self, session_id: str, profile: Optional[str], eligible_reliefs: Optional[List[str]]) -> None:
+        """Replace the profile and the eligible reliefs of a session"""
+
+    @abc.abstractmethod
+    def clear(self, session_id: str) -> None:
+        """Delete the messages, archive and profile of a session"""
+
+    @abc.abstractmethod
+    def archived_messages(self, session_id: str) -> List[Dict[str, str]]:
+        """Return the compacted messages of a session, oldest first"""
+
+    def flush(self) -> None:
+        """Write everything queued so far"""
+
+    def purge_expired(self) -> int:
+        """Delete the sessions that expired, returning how many"""
+        return 0
+
+
+class _Session:
+    __slots__ = ("messages", "archived", "profile", "eligible_reliefs")
+
+    def __init__(self, messages, archived, profile, eligible_reliefs):
+        self.messages = messages
+        self.archived = archived
+        self.profile = profile
+        self.eligible_reliefs = eligible_reliefs
+
+
+class SQLiteConversationStore(ConversationStore):
+    """Conversations in a SQLite file of the cache directory, see the notes at the top of this module"""
+
+    def __init__(self, db_name: str = "conversations.sqlite3",
+                 cache_sessions: int = CONVERSATION_CACHE_SESSIONS,
+                 max_messages: int = CONVERSATION_MAX_MESSAGES,
+                 keep_messages: int = CONVERSATION_KEEP_MESSAGES,
+                 flush_interval: float = CONVERSATION_FLUSH_INTERVAL,
+                 flush_batch: int = CONVERSATION_FLUSH_BATCH,
+                 ttl: float = CONVERSATION_TTL,
+                 purge_interval: float = CONVERSATION_PURGE_INTERVAL):
+        self.db_name = db_name
+        self.cache_sessions = cache_sessions
+        self.max_messages = max_messages
+        self.keep_messages = keep_messages
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._sessions = OrderedDict()
+        # Sessions dropped from memory so far, see _locked_session
+        self._evictions = 0
+        # Queued (sql, parameters) statements, committed in order
+        self._pending = []
+        self._lock = threading.Lock()
+        # Flushes run one at a time, so the queued statements are committed in the order they were queued
+        self._flush_lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        threading.Thread(target=self._flush_periodically, name="conversation-store", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _open(self):
+        return open_cache(self.db_name, _SCHEMA)
+
+    def _read_session(self, session_id: str) -> _Session:
+        with self._open() as connection:
+            rows = connection.execute(
+                "SELECT role, content FROM messages WHERE session_id = ? ORDER BY position", (session_id,)
+            ).fetchall()
+            archived = connection.execute(
+                "SELECT COALESCE(SUM(message_count), 0) FROM archives WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            row = connection.execute(
+                "SELECT profile, eligible_reliefs FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        profile, eligible_reliefs = row if row else (None, None)
+        return _Session([{"role": role, "content": content} for role, content in rows], archived,
+                        profile, json.loads(eligible_reliefs) if eligible_reliefs else None)
+
+    def _use(self, session_id: str, session: _Session) -> _Session:
+        """Keep the session in memory as the most recently used one; call with _lock held"""
+        self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.cache_sessions:
+            self._sessions.popitem(last=False)
+            self._evictions += 1
+        return session
+
+    @contextmanager
+    def _locked_session(self, session_id: str):
+        """
+        Hold _lock and give the session, from memory or from the database.
+        A session not in memory is read without holding _lock, so other sessions are not kept waiting on the disk.
+        """
+        while True:
+            with self._lock:
+                session = self._sessions.get(session_id)
+                if session is not None:
+                    yield self._use(session_id, session)
+                    return
+                evictions = self._evictions
+            # Queued writes of the session, e.g. from before it was evicted, must be read back too
+            self.flush()
+            loaded = self._read_session(session_id)
+            with self._lock:
+                # Another thread may have loaded it meanwhile
+                session = self._sessions.get(session_id)
+                if session is None:
+                    if self._evictions != evictions:
+                        # It may have been loaded, changed and evicted again since it was read: read it again
+                        continue
+                    session = loaded
+                yield self._use(session_id, session)
+                return
+
+    def _queue(self, sql: str, parameters: tuple) -> None:
+        self._pending.append((sql, parameters))
+        if len(self._pending) >= self.flush_batch:
+            self._flush_requested.set()
+
+    def _touch(self, session_id: str, session: _Session) -> None:
+        eligible_reliefs = None if session.eligible_reliefs is None else json.dumps(session.eligible_reliefs)
+        self._queue("INSERT OR REPLACE INTO sessions (session_id, profile, eligible_reliefs, updated_at) "
+                    "VALUES (?, ?, ?, ?)", (session_id, session.profile, eligible_reliefs, time.time()))
+
+    def _compact(self, session_id: str, session: _Session) -> None:
+        """Move the oldest messages into a compressed archive row, keeping the newest keep_messages in memory"""
+        count = len(session.messages) - self.keep_messages
+        compacted, session.messages = session.messages[:count], session.messages[count:]
+        first_position = session.archived
+        self._queue("INSERT INTO archives (session_id, first_position, message_count, messages) VALUES (?, ?, ?, ?)",
+                    (session_id, first_position, count, zlib.compress(json.dumps(compacted).encode("utf-8"))))
+        self._queue("DELETE FROM messages WHERE session_id = ? AND position < ?", (session_id, first_position + count))
+        session.archived += count
+
+    def load(self, session_id: str) -> Conversation:
+        with self._locked_session(session_id) as session:
+            eligible_reliefs = None if session.eligible_reliefs is None else list(session.eligible_reliefs)
+            return Conversation(list(session.messages), session.archived, session.profile, eligible_reliefs)
+
+    def append(self, session_id: str, role: str, content: str) -> None:
+        with self._locked_session(session_id) as session:
+            position = session.archived + len(session.messages)
+            session.messages.append({"role": role, "content": content})
+            self._queue("INSERT OR REPLACE INTO messages (session_id, position, role, content) VALUES (?, ?, ?, ?)",
+                        (session_id, position, role, content))
+            if len(session.messages) > self.max_messages:
+                self._compact(session_id, session)
+            self._touch(session_id, session)
+
+    def set_profile(self, session_id: str, profile: Optional[str], eligible_reliefs: Optional[List[str]]) -> None:
+        with self._locked_session(session_id) as session:
+            session.profile = profile
+            session.eligible_reliefs = None if eligible_reliefs is None else list(eligible_reliefs)
+            self._touch(session_id, session)
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions[session_id] = _Session([], 0, None, None)
+            self._sessions.move_to_end(session_id)
+            for table in ("messages", "archives", "sessions"):
+                self._queue(f"DELETE FROM {table} WHERE session_id = ?", (session_id,))
+
+    def archived_messages(self, session_id: str) -> List[Dict[str, str]]:
+        self.flush()
+        with self._open() as connection:
+            rows = connection.execute(
+                "SELECT messages FROM archives WHERE session_id = ? ORDER BY first_position", (session_id,)
+            ).fetchall()
+        return [message for (blob,) in rows for message in json.loads(zlib.decompress(blob))]
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            try:
+                # One transaction for the whole batch
+                with self._open() as connection:
+                    for sql, parameters in pending:
+                        connection.execute(sql, parameters)
+            except Exception:
+                # Nothing of the batch was committed: queue it again, ahead of the statements queued since
+                with self._lock:
+                    self._pending[:0] = pending
+                raise
+
+    def purge_expired(self) -> int:
+        """Delete the sessions not updated for ttl seconds, with their messages and archives; returns how many"""
+        if self.ttl <= 0:
+            return 0
+        cutoff = time.time() - self.ttl
+        with self._flush_lock:
+            # Sessions are not used meanwhile, so a session updated during the purge is never half deleted,
+            # and the queued writes are committed first so updated_at is current
+            with self._lock:
+                pending, self._pending = self._pending, []
+                try:
+                    with self._open() as connection:
+                        for sql, parameters in pending:
+                            connection.execute(sql, parameters)
+                        expired = [(session_id,) for (session_id,) in connection.execute(
+                            "SELECT session_id FROM sessions WHERE updated_at < ?", (cutoff,))]
+                        for table in ("messages", "archives", "sessions"):
+                            connection.executemany(f"DELETE FROM {table} WHERE session_id = ?", expired)
+                except Exception:
+                    self._pending[:0] = pending
+                    raise
+                for (session_id,) in expired:
+                    if self._sessions.pop(session_id, None) is not None:
+                        self._evictions += 1
+        return len(expired)
+
+    def _flush_periodically(self) -> None:
+        next_purge = time.monotonic()
+        while True:
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            try:
+                self.flush()
+                if time.monotonic() >= next_purge:
+                    next_purge = time.monotonic() + self.purge_interval
+                    self.purge_expired()
+            except Exception:
+                # e.g. the database is locked for too long; the batch is retried on the next flush
+                pass
+
+
+def _create_conversation_store(kind):
+    if kind == "sqlite":
+        return SQLiteConversationStore()
+    raise ValueError(f"Unknown conversation store {kind!r}, expected one of {CONVERSATION_STORES}")
+
+
+_conversation_stores = {}
+_conversation_store_lock = threading.Lock()
+
+def get_conversation_store(kind=DEFAULT_CONVERSATION_STORE) -> ConversationStore:
+    """Return the conversation store shared by every session of the process, creating it on first use"""
+    store = _conversation_stores.get(kind)
+    if store is None:
+        with _conversation_store_lock:
+            store = _conversation_stores.get(kind)
+            if store is None:
+                store = _conversation_stores[kind] = _create_conversation_store(kind)
+    return store
@@ -0,0 +1,139 @@
+# Batched, rate-limit-aware embedding of large sets of texts.
+# Texts are grouped into requests by token count (measured with count_tokens_batch, using the encoding of the
+# embedding model, cl100k_base for text-embedding-3-small) up to the API's per-request limits, the requests run
+# concurrently under a tokens-per-minute budget, 429 responses are retried with exponential backoff, and each
+# finished batch is handed to a callback (e.g. to write it into Chroma) instead of waiting for the whole corpus.
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional, Tuple
+import openai
+from helper_functions.llm import count_tokens_batch
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Limits of the embeddings endpoint: tokens per input, inputs per request and tokens per request
+MAX_INPUT_TOKENS = 8191
+MAX_BATCH_SIZE = 2048
+MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", 100000))
+
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 4))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", 1000000))
+EMBEDDING_MAX_RETRIES = 6
+
+
+class TokenBucket:
+    """Thread-safe tokens-per-minute budget; acquire blocks until the tokens are available"""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.tokens = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> None:
+        # A request larger than the whole budget waits for a full bucket rather than forever
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Budget shared by every embedding request of the process, as the rate limit applies to the whole account
+token_budget = TokenBucket(EMBEDDING_TOKENS_PER_MINUTE)
+
+
+def make_batches(texts: List[str], max_batch_tokens: int = MAX_BATCH_TOKENS,
+                 max_batch_size: int = MAX_BATCH_SIZE, model: str = EMBEDDING_MODEL) -> List[Tuple[List[int], int]]:
+    """
+    Group texts into requests that stay within the per-request limits, counting tokens as the model does.
+
+    Returns:
+        list: (indexes into texts, token count) pair for each batch, in order
+
+    Raises:
+        ValueError: If a single text is longer than the model accepts
+    """
+    batches, current, current_tokens = [], [], 0
+    for index, tokens in enumerate(count_tokens_batch(texts, model=model)):
+        if tokens > MAX_INPUT_TOKENS:
+            raise ValueError(f"Text {index} has {tokens} tokens, more than the {MAX_INPUT_TOKENS} the embedding model accepts")
+        if current and (current_tokens + tokens > max_batch_tokens or len(current) >= max_batch_size):
+            batches.append((current, current_tokens))
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append((current, current_tokens))
+    return batches
+
+
+def _is_rate_limit(error: Exception) -> bool:
+    return isinstance(error, openai.RateLimitError) or getattr(error, "status_code", None) == 429
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Delay requested by the API in the Retry-After header, if any"""
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def embed_with_retry(texts: List[str], embed_fn: Callable, max_retries: int = EMBEDDING_MAX_RETRIES) -> List[List[float]]:
+    """Call embed_fn, retrying rate-limited requests with exponential backoff and jitter"""
+    for attempt in range(max_retries + 1):
+        try:
+            return embed_fn(texts)
+        except Exception as e:
+            if not _is_rate_limit(e) or attempt == max_retries:
+                raise
+            delay = _retry_after(e) or min(60.0, 2 ** attempt) * (0.5 + random.random())
+            time.sleep(delay)
+
+
+def embed_in_batches(texts: List[str], embed_fn: Callable,
+                     on_batch: Optional[Callable[[List[int], List[List[float]]], None]] = None,
+                     max_concurrency: int = EMBEDDING_CONCURRENCY,
+                     bucket: TokenBucket = token_budget, model: str = EMBEDDING_MODEL) -> List[List[float]]:
+    """
+    Embed many texts with concurrent, rate-limited requests.
+
+    Args:
+        texts: Texts to embed
+        embed_fn: Function embedding a list of texts into a list of vectors, e.g. an Embeddings.embed_documents
+        on_batch: Called with the indexes and vectors of each batch as soon as it finishes
+        max_concurrency: Maximum number of requests in flight
+        bucket: Tokens-per-minute budget the requests draw from, shared by the whole process by default
+        model: Embedding model called by embed_fn, whose encoding the token counts use
+
+    Returns:
+        list: One vector per text, in the same order
+    """
+    batches = make_batches(texts, model=model)
+    vectors = [None] * len(texts)
+
+    def run(indexes, tokens):
+        bucket.acquire(tokens)
+        return indexes, embed_with_retry([texts[i] for i in indexes], embed_fn)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        futures = [pool.submit(run, indexes, tokens) for indexes, tokens in batches]
+        for future in as_completed(futures):
+            indexes, batch_vectors = future.result()
+            for i, vector in zip(indexes, batch_vectors):
+                vectors[i] = vector
+            if on_batch is not None:
+                on_batch(indexes, batch_vectors)
+
+    return vectors
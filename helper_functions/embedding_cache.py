@@ -0,0 +1,140 @@
+# Persistent, content-addressed cache of embeddings.
+# Vectors are stored in a local SQLite file keyed by the model and a hash of the text, so repeated
+# questions and unchanged chunks are never sent to the embeddings API twice, across sessions and restarts.
+# The least recently used entries are evicted once the cache holds more than max_entries vectors.
+import hashlib
+import os
+import threading
+import time
+from array import array
+from typing import List, Optional
+from langchain_core.embeddings import Embeddings
+from helper_functions.sqlite_cache import open_cache
+
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 50000))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+"""
+
+
+def _key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite-backed embedding store with LRU eviction and hit/miss counters"""
+
+    def __init__(self, db_name: str = "embeddings.sqlite3", max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.db_name = db_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Return the cached vector of each text, or None where it is not cached"""
+        keys = [_key(model, text) for text in texts]
+        found = {}
+        with open_cache(self.db_name, _SCHEMA) as connection:
+            # Stay well below SQLite's limit on the number of query parameters
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+            if found:
+                connection.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(time.time(), key) for key in found]
+                )
+
+        vectors = []
+        for key in keys:
+            blob = found.get(key)
+            if blob is None:
+                vectors.append(None)
+            else:
+                vector = array("f")
+                vector.frombytes(blob)
+                vectors.append(vector.tolist())
+
+        with self._lock:
+            self.hits += len(texts) - vectors.count(None)
+            self.misses += vectors.count(None)
+        return vectors
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]) -> None:
+        """Store vectors as float32 and evict the least recently used entries beyond max_entries"""
+        now = time.time()
+        rows = [(_key(model, text), model, array("f", vector).tobytes(), now) for text, vector in zip(texts, vectors)]
+        with open_cache(self.db_name, _SCHEMA) as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            excess = connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+            if excess > 0:
+                connection.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                )
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+# Shared by get_embedding and every CachedEmbeddings instance
+embedding_cache = EmbeddingCache()
+
+
+def embed_with_cache(model: str, texts: List[str], embed_fn, cache: EmbeddingCache = embedding_cache) -> List[List[float]]:
+    """
+    Embed texts, only calling embed_fn for the texts that are not cached yet.
+
+    Args:
+        model: Name of the embedding model, part of the cache key
+        texts: Texts to embed
+        embed_fn: Function embedding a list of texts into a list of vectors
+        cache: The cache to use
+
+    Returns:
+        list: One vector per text, in the same order
+    """
+    vectors = cache.get_many(model, texts)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        # Identical texts in the same call are only embedded once
+        unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+        new_vectors = dict(zip(unique_texts, embed_fn(unique_texts)))
+        cache.put_many(model, list(new_vectors), list(new_vectors.values()))
+        for i in missing:
+            vectors[i] = new_vectors[texts[i]]
+    return vectors
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps a LangChain embeddings object (e.g. OpenAIEmbeddings) so documents and queries go through the embedding cache.
+    Query and document embeddings share cache entries, which holds for the OpenAI models as they embed both the same way.
+    """
+
+    def __init__(self, underlying: Embeddings, model: Optional[str] = None, cache: EmbeddingCache = embedding_cache):
+        self.underlying = underlying
+        self.model = model or getattr(underlying, "model", type(underlying).__name__)
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return embed_with_cache(self.model, texts, self.underlying.embed_documents, self.cache)
+
+    def embed_query(self, text: str) -> List[float]:
+        return embed_with_cache(self.model, [text], lambda texts: [self.underlying.embed_query(texts[0])], self.cache)[0]
@@ -0,0 +1,42 @@
+# Persistent cache for the answers to the fixed guideline questions of the rental analysis.
+# The answers only depend on the question, the model and the content of the collection they are
+# retrieved from, so they are keyed on all three. Regenerating the collection changes its
+# fingerprint (see collection_fingerprint in helper_functions/vector_store.py), which makes
+# the old answers unreachable; they are deleted the next time an answer to the same question is stored.
+import time
+from helper_functions.sqlite_cache import open_cache
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS guidelines (
+    query TEXT NOT NULL,
+    model TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (query, model, fingerprint)
+);
+"""
+
+def _open():
+    return open_cache("guidelines.sqlite3", _SCHEMA)
+
+def get_cached_guideline(query, model, fingerprint):
+    """Return the cached answer for the query, or None if there is none for this model and collection"""
+    with _open() as connection:
+        row = connection.execute(
+            "SELECT answer FROM guidelines WHERE query = ? AND model = ? AND fingerprint = ?",
+            (query, model, fingerprint)
+        ).fetchone()
+    return row[0] if row else None
+
+def store_guideline(query, model, fingerprint, answer):
+    """Cache the answer to the query, dropping answers computed against earlier versions of the collection"""
+    with _open() as connection:
+        connection.execute(
+            "DELETE FROM guidelines WHERE query = ? AND model = ? AND fingerprint != ?",
+            (query, model, fingerprint)
+        )
+        connection.execute(
+            "INSERT OR REPLACE INTO guidelines (query, model, fingerprint, answer, created_at) VALUES (?, ?, ?, ?, ?)",
+            (query, model, fingerprint, answer, time.time())
+        )
@@ -0,0 +1,118 @@
+# Hybrid retrieval: BM25 lexical search and Chroma vector search fused with reciprocal rank fusion.
+# Questions naming an exact relief title are found by BM25, paraphrased questions by the embeddings,
+# and a chunk ranked well by both comes first. Scores of the two searches are not comparable, so only
+# their ranks are fused: each chunk scores sum(1 / (rrf_k + rank)) over the searches that returned it.
+# A Chroma `where` filter can be passed per query, e.g. retriever.invoke(query, filter=where), and
+# restricts both searches to the chunks whose metadata matches it.
+# Vector search alone stays the default (RETRIEVAL_MODE=vector) until the hybrid is shown to retrieve better
+# on the hand-labelled queries of benchmarks/eval_hybrid_retrieval.py; set RETRIEVAL_MODE=hybrid to fuse in BM25.
+import os
+from typing import Any, Dict, List, Optional
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+from helper_functions.bm25 import BM25Index, load_bm25_index
+from helper_functions.ingestion import chunk_id
+
+RETRIEVAL_MODES = ("vector", "hybrid")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+RRF_K = 60
+# Candidates taken from each search before fusion
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", 20))
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int, rrf_k: int = RRF_K) -> List[Document]:
+    """Fuse ranked lists of documents, identifying a chunk in different lists by its content (see chunk_id)"""
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            key = chunk_id(document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            documents.setdefault(key, document)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in best]
+
+
+def matches_where(metadata: Dict[str, Any], where: Dict[str, Any]) -> bool:
+    """
+    Evaluate a Chroma `where` filter against a chunk's metadata, for the BM25 side of the search.
+    Supports $and, $or, plain equality and the $eq, $ne and $in operators.
+    """
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            for operator, value in condition.items():
+                if operator == "$eq":
+                    matched = key in metadata and metadata[key] == value
+                elif operator == "$ne":
+                    matched = metadata.get(key) != value
+                elif operator == "$in":
+                    matched = key in metadata and metadata[key] in value
+                else:
+                    raise ValueError(f"Unsupported operator {operator!r} in filter")
+                if not matched:
+                    return False
+        elif key not in metadata or metadata[key] != condition:
+            return False
+    return True
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever over a Chroma collection combining its vector search with its BM25 index, or in "vector" mode
+    returning its vector search alone; unlike the retriever of as_retriever, both honour a per-query filter.
+    Exposes the vector store as `vectorstore`, like the retriever of as_retriever, which the semantic cache relies on.
+    """
+
+    vectorstore: VectorStore
+    bm25_index: Optional[BM25Index] = None
+    mode: str = RETRIEVAL_MODE
+    k: int = 5
+    fetch_k: int = HYBRID_FETCH_K
+    rrf_k: int = RRF_K
+
+    @classmethod
+    def from_vector_store(cls, vector_store: VectorStore, k: int = 5, mode: str = RETRIEVAL_MODE,
+                          **kwargs) -> "HybridRetriever":
+        """
+        Create the retriever of a collection. In "hybrid" mode it gets the collection's saved BM25 index,
+        which is built if needed.
+
+        Raises:
+            ValueError: If mode is not one of RETRIEVAL_MODES
+        """
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {mode!r}, expected one of {RETRIEVAL_MODES}")
+        bm25_index = load_bm25_index(vector_store) if mode == "hybrid" else None
+        return cls(vectorstore=vector_store, bm25_index=bm25_index, mode=mode, k=k, **kwargs)
+
+    def lexical_search(self, query: str, filter: Optional[Dict] = None) -> List[Document]:
+        metadatas = self.bm25_index.metadatas
+        allowed = None
+        if filter is not None:
+            allowed = {position for position, metadata in enumerate(metadatas) if matches_where(metadata, filter)}
+        return [
+            Document(page_content=self.bm25_index.texts[position], metadata=metadatas[position])
+            for position, _ in self.bm25_index.search(query, k=self.fetch_k, allowed=allowed)
+        ]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                filter: Optional[Dict] = None) -> List[Document]:
+        if self.mode == "vector":
+            return self.vectorstore.similarity_search(query, k=self.k, filter=filter)
+        vector_documents = self.vectorstore.similarity_search(query, k=self.fetch_k, filter=filter)
+        return reciprocal_rank_fusion([vector_documents, self.lexical_search(query, filter)], self.k, self.rrf_k)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun,
+                                       filter: Optional[Dict] = None) -> List[Document]:
+        if self.mode == "vector":
+            return await self.vectorstore.asimilarity_search(query, k=self.k, filter=filter)
+        vector_documents = await self.vectorstore.asimilarity_search(query, k=self.fetch_k, filter=filter)
+        return reciprocal_rank_fusion([vector_documents, self.lexical_search(query, filter)], self.k, self.rrf_k)
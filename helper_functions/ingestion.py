@@ -0,0 +1,168 @@
+# Incremental ingestion of documents into the Chroma collections.
+# Every chunk gets a deterministic id derived from its content, so re-running a generator script only
+# embeds and adds the chunks that are new or changed, and deletes the chunks that are no longer produced.
+# Re-running it on an unchanged corpus makes no embedding calls.
+# PDF pages are extracted in parallel and every chunk keeps the source and page it came from.
+# The embedding backend of a collection is recorded in its metadata; switching backend rebuilds the collection.
+# A BM25 index of the synced chunks is saved in the cache directory for hybrid retrieval.
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Tuple
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from helper_functions.vector_store import EMBEDDING_MODEL, PERSIST_DIRECTORY, forget_fingerprint
+from helper_functions.bm25 import build_bm25_index, bm25_index_path
+
+
+def _extract_pages(path: str, page_indexes: List[int]) -> List[Tuple[int, str]]:
+    """Extract the text of some pages of a PDF; runs in a worker process"""
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    return [(index, reader.pages[index].extract_text() or "") for index in page_indexes]
+
+
+def load_pdf_pages(path: str, max_workers: int = None) -> List[Document]:
+    """
+    Load every page of a PDF as its own document, extracting the pages in parallel.
+
+    The pages are dealt out round-robin to the worker processes, so long and short pages are spread
+    evenly; text extraction is CPU bound, so processes rather than threads are used.
+
+    Args:
+        path: Path of the PDF file
+        max_workers: Number of worker processes, defaults to the number of CPUs
+
+    Returns:
+        list: One Document per page, with "source" and the 1-based "page" number in its metadata
+    """
+    # Only the generator scripts read PDFs, so the app does not import pypdf
+    from pypdf import PdfReader
+
+    num_pages = len(PdfReader(path).pages)
+    workers = max(1, min(max_workers or os.cpu_count() or 1, num_pages))
+    ranges = [list(range(worker, num_pages, workers)) for worker in range(workers)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pages = [page for result in pool.map(_extract_pages, [path] * workers, ranges) for page in result]
+
+    return [
+        Document(page_content=text, metadata={"source": path, "page": index + 1})
+        for index, text in sorted(pages)
+        if text.strip()
+    ]
+
+
+def split_documents(documents: List[Document], text_splitter) -> List[Document]:
+    """Split every document into chunks, each chunk keeping the metadata (source, page) of its document"""
+    return text_splitter.split_documents(documents)
+
+
+def chunk_id(document: Document) -> str:
+    """Deterministic id of a chunk: a hash of its text and metadata"""
+    payload = json.dumps({"text": document.page_content, "metadata": document.metadata}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Chunks written to Chroma per call when embedding with a local model
+LOCAL_UPSERT_BATCH_SIZE = 1000
+
+
+def sync_collection(collection_name: str, documents: List[Document], embedding: Embeddings,
+                    persist_directory: str = PERSIST_DIRECTORY,
+                    embedding_backend: str = "openai") -> Tuple[Chroma, Dict]:
+    """
+    Make a collection hold exactly the given chunks.
+
+    Chunks whose id is already in the collection are left alone, new ones are embedded in batches
+    (concurrent and rate-limited for OpenAI, see helper_functions/embedding_batcher.py) and added as each batch finishes,
+    and chunks in the collection that are not in documents are deleted. Chunks added by earlier
+    versions of the scripts (with random ids) are therefore removed on the first run.
+
+    The BM25 index of the collection (see helper_functions/bm25.py) is rebuilt from the synced chunks.
+
+    Vectors of different backends cannot be compared, so a collection built with another backend
+    is deleted and rebuilt from scratch.
+
+    Args:
+        collection_name: Name of the Chroma collection
+        documents: The complete set of chunks the collection should contain
+        embedding: Embeddings used for the new chunks
+        persist_directory: Directory of the Chroma database
+        embedding_backend: Name of the backend of embedding, recorded in the collection's metadata
+
+    Returns:
+        tuple: The vector store and a dict with the number of chunks added, deleted and unchanged,
+            whether the collection was rebuilt, and the elapsed seconds
+    """
+    start = time.perf_counter()
+    vector_store = Chroma(
+        collection_name=collection_name,
+        embedding_function=embedding,
+        persist_directory=persist_directory,
+    )
+    metadata = vector_store._collection.metadata or {}
+    # Collections built before backends were recorded used OpenAI
+    rebuilt = bool(vector_store._collection.count()) and metadata.get("embedding_backend", "openai") != embedding_backend
+    if rebuilt:
+        vector_store.delete_collection()
+        vector_store = Chroma(
+            collection_name=collection_name,
+            embedding_function=embedding,
+            persist_directory=persist_directory,
+        )
+    if metadata.get("embedding_backend") != embedding_backend:
+        vector_store._collection.modify(metadata={"embedding_backend": embedding_backend})
+
+    # Identical chunks are only stored once
+    wanted = {}
+    for document in documents:
+        wanted.setdefault(chunk_id(document), document)
+
+    existing = set(vector_store._collection.get(include=[])["ids"])
+    new_ids = [id_ for id_ in wanted if id_ not in existing]
+    stale_ids = list(existing - wanted.keys())
+
+    if new_ids:
+        new_documents = [wanted[id_] for id_ in new_ids]
+
+        # Write every batch into the collection as soon as its vectors arrive
+        def upsert(indexes, vectors):
+            vector_store._collection.upsert(
+                ids=[new_ids[i] for i in indexes],
+                embeddings=vectors,
+                documents=[new_documents[i].page_content for i in indexes],
+                # Chroma rejects empty metadata dicts
+                metadatas=[new_documents[i].metadata or {"source": ""} for i in indexes],
+            )
+
+        texts = [doc.page_content for doc in new_documents]
+        if embedding_backend == "openai":
+            # Imported here so the app, which only needs chunk_id from this module, does not load the batcher
+            from helper_functions.embedding_batcher import embed_in_batches
+            embed_in_batches(texts, embedding.embed_documents, on_batch=upsert, model=EMBEDDING_MODEL)
+        else:
+            # A local model has no rate limit and batches its own inference
+            for offset in range(0, len(texts), LOCAL_UPSERT_BATCH_SIZE):
+                indexes = list(range(offset, min(offset + LOCAL_UPSERT_BATCH_SIZE, len(texts))))
+                upsert(indexes, embedding.embed_documents([texts[i] for i in indexes]))
+    if stale_ids:
+        vector_store.delete(ids=stale_ids)
+    if new_ids or stale_ids:
+        # The caches of this process see the new content right away, other processes within FINGERPRINT_CHECK_INTERVAL
+        forget_fingerprint(vector_store)
+
+    # The lexical index always covers exactly the chunks now in the collection
+    build_bm25_index(vector_store).save(bm25_index_path(collection_name, persist_directory))
+
+    stats = {
+        "added": len(new_ids),
+        "deleted": len(stale_ids),
+        "unchanged": len(wanted) - len(new_ids),
+        "rebuilt": rebuilt,
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+    return vector_store, stats
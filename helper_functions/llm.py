@@ -1,24 +1,50 @@
 # Import relevant packages
+import asyncio
 import os
-from langchain.chains import RetrievalQA
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from langchain_openai import ChatOpenAI
+from langchain_core.prompts import format_document
 from dotenv import load_dotenv
 from openai import OpenAI
 import tiktoken
+from helper_functions.embedding_cache import embed_with_cache
+from helper_functions.semantic_cache import semantic_cache, chat_cache_scope
+from helper_functions.stub_models import STUB_MODELS, StubChatModel
+from helper_functions.vector_store import current_fingerprint
 
-# load environment variables via the .env file
-load_dotenv('.env')
+# load environment variables via the .env file, once per process
+@lru_cache(maxsize=None)
+def load_environment(path='.env'):
+    return load_dotenv(path)
+
+load_environment()
 
 # Pass the API Key to the OpenAI Client
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# The client is created on first use, so importing this module for the chat does not build it
+@lru_cache(maxsize=None)
+def get_openai_client():
+    return OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
 # Function to generate embeddings
+# Texts embedded before are read from the persistent embedding cache instead of calling the API;
+# the others are sent in token-limited batches with retries on rate limits
 def get_embedding(input, model='text-embedding-3-small'):
-    response = client.embeddings.create(
-        input=input,
-        model=model
-    )
-    return [x.embedding for x in response.data]
+    # Imported here as the batcher itself counts tokens with this module
+    from helper_functions.embedding_batcher import embed_in_batches
+
+    texts = [input] if isinstance(input, str) else list(input)
+
+    def embed(batch_texts):
+        response = get_openai_client().embeddings.create(
+            input=batch_texts,
+            model=model
+        )
+        return [x.embedding for x in response.data]
+
+    return embed_with_cache(model, texts, lambda missing_texts: embed_in_batches(missing_texts, embed, model=model))
 
 # Function for text generation
 # This is the "Updated" helper function for calling LLM
@@ -30,7 +56,7 @@ def get_completion(prompt, model="gpt-4o-mini", temperature=0, top_p=1.0, max_to
     
     messages = [{"role": "user", "content": prompt}]
 
-    response = client.chat.completions.create( #originally was openai.chat.completions
+    response = get_openai_client().chat.completions.create( #originally was openai.chat.completions
         model=model,
         messages=messages,
         temperature=temperature,
@@ -46,7 +72,7 @@ def get_completion(prompt, model="gpt-4o-mini", temperature=0, top_p=1.0, max_to
 # Note that this function directly take in "messages" as the parameter.
 
 def get_completion_from_messages(messages, model="gpt-4o-mini", temperature=0, top_p=1.0, max_tokens=1024, n=1):
-    response = client.chat.completions.create(
+    response = get_openai_client().chat.completions.create(
         model=model,
         messages=messages,
         temperature=temperature,
@@ -58,34 +84,296 @@ def get_completion_from_messages(messages, model="gpt-4o-mini", temperature=0, t
 
 # These functions are for calculating the tokens.
 # ⚠️ These are simplified implementations that are good enough for a rough estimation.
+# The encoder is created once per model, and the count of each chat message is cached, as the history window
+# recounts the same messages on every turn; many texts are best counted at once with count_tokens_batch.
+TOKEN_COUNT_THREADS = int(os.getenv('TOKEN_COUNT_THREADS', 8))
+# Below this many texts, starting the threads of encode_batch costs more than it saves
+TOKEN_COUNT_BATCH_MIN = 16
+MESSAGE_TOKEN_CACHE_SIZE = 4096
+
+_message_token_cache = OrderedDict()
+_message_token_lock = threading.Lock()
+
+@lru_cache(maxsize=None)
+def get_encoding(model='gpt-4o-mini'):
+    """Return the tiktoken encoder of a model, created on first use"""
+    return tiktoken.encoding_for_model(model)
 
 def count_tokens(text):
-    encoding = tiktoken.encoding_for_model('gpt-4o-mini')
-    return len(encoding.encode(text))
+    return len(get_encoding().encode(text))
+
+def count_tokens_batch(texts, num_threads=TOKEN_COUNT_THREADS, model='gpt-4o-mini'):
+    """Count the tokens of many texts in one call with the encoding of model, encoding them on num_threads threads"""
+    texts = list(texts)
+    encoding = get_encoding(model)
+    if len(texts) < TOKEN_COUNT_BATCH_MIN:
+        return [len(encoding.encode(text)) for text in texts]
+    return [len(tokens) for tokens in encoding.encode_batch(texts, num_threads=num_threads)]
+
+def count_message_tokens(message):
+    """
+    Count the tokens of one message's content, cached per message object.
+    The cache holds the message itself, so its id cannot be reused by another object while cached,
+    and the count is only reused while the content is unchanged. The least recently used entries are evicted.
+    """
+    key = id(message)
+    content = message.get('content')
+    with _message_token_lock:
+        entry = _message_token_cache.get(key)
+        if entry is not None and entry[0] is message and entry[1] == content:
+            _message_token_cache.move_to_end(key)
+            return entry[2]
+
+    tokens = count_tokens(content)
+    with _message_token_lock:
+        _message_token_cache[key] = (message, content, tokens)
+        _message_token_cache.move_to_end(key)
+        while len(_message_token_cache) > MESSAGE_TOKEN_CACHE_SIZE:
+            _message_token_cache.popitem(last=False)
+    return tokens
 
 def count_tokens_from_message(messages):
-    encoding = tiktoken.encoding_for_model('gpt-4o-mini')
-    value = ' '.join([x.get('content') for x in messages])
-    return len(encoding.encode(value))
+    return sum(count_message_tokens(x) for x in messages)
+
+def truncate_tokens(text, max_tokens):
+    """Cut text down to its first max_tokens tokens, marking the cut with an ellipsis"""
+    encoding = get_encoding()
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens]) + "…"
+
+
+# Conversation history window for the chatbot.
+# The full history used to be sent with every turn, so cost and latency grew with the conversation.
+# Only the newest turns are now kept verbatim within a token budget, older turns are shortened, and
+# anything that still does not fit is dropped.
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', 1500))
+HISTORY_COMPACT_TOKENS = 80
+RETRIEVAL_CONTEXT_TOKENS = 60
+
+def build_history_window(messages, prompt, token_budget=HISTORY_TOKEN_BUDGET, compact_tokens=HISTORY_COMPACT_TOKENS):
+    """
+    Select the part of the conversation to send along with the current prompt.
+
+    System messages are always kept. The remaining turns are walked from newest to oldest: each one
+    is kept verbatim while it fits in the budget, otherwise it is truncated to compact_tokens, and
+    once even the truncated turn does not fit, it and every older turn are dropped.
+
+    Args:
+        messages: The conversation as a list of {"role", "content"} dicts
+        prompt: The current user prompt, which is excluded from the window if it is the last message
+        token_budget: Maximum number of tokens for the returned messages, measured with count_tokens_from_message
+        compact_tokens: Length that turns which do not fit verbatim are truncated to
+
+    Returns:
+        list: The selected messages in chronological order
+    """
+    # The caller usually appends the prompt to the messages before asking for a response
+    if messages and messages[-1].get("role") == "user" and messages[-1].get("content") == prompt:
+        messages = messages[:-1]
+
+    system_messages = [msg for msg in messages if msg.get("role") == "system"]
+    turns = [msg for msg in messages if msg.get("role") != "system"]
+
+    used = count_tokens_from_message(system_messages) if system_messages else 0
+    window = []
+    for msg in reversed(turns):
+        tokens = count_tokens_from_message([msg])
+        if used + tokens > token_budget:
+            msg = {**msg, "content": truncate_tokens(msg["content"], compact_tokens)}
+            # A new dict on every call, so it is not worth caching
+            tokens = count_tokens(msg["content"])
+            if used + tokens > token_budget:
+                break
+        window.append(msg)
+        used += tokens
+
+    return system_messages + list(reversed(window))
+
+def build_retrieval_query(messages, prompt, context_tokens=RETRIEVAL_CONTEXT_TOKENS):
+    """
+    Build the text embedded for retrieval: the current prompt plus a short excerpt of the previous
+    user turn, so that follow-up questions such as "what about the second one?" still retrieve the right chunks.
+    """
+    for msg in reversed(messages):
+        if msg.get("role") == "user" and msg.get("content") != prompt:
+            return f"{truncate_tokens(msg['content'], context_tokens)}\n{prompt}"
+    return prompt
+
 
+# Process-wide registries of LLM clients and QA chains.
+# Streamlit reruns the script for every interaction, so building these per chat turn would repeat
+# the client setup and throw away the HTTP connection pool each time. Every session shares them instead;
+# ChatOpenAI and RetrievalQA hold no per-request state, so concurrent invocations are safe.
+# QA chains are looked up by the identity of their retriever, so callers building retrievers on the fly
+# (e.g. with a per-user filter) would add a chain per call: only the most recently used ones are kept.
+QA_CHAIN_CACHE_SIZE = int(os.getenv('QA_CHAIN_CACHE_SIZE', 16))
+
+_llm_registry = {}
+_qa_chain_registry = OrderedDict()
+_registry_lock = threading.Lock()
+
+def get_chat_llm(model="gpt-4o-mini", temperature=None):
+    """Return the shared ChatOpenAI client for the model, creating it on first use"""
+    key = (model, temperature)
+    llm = _llm_registry.get(key)
+    if llm is None:
+        with _registry_lock:
+            llm = _llm_registry.get(key)
+            if llm is None:
+                # Only override the temperature when asked to, so the client default still applies otherwise
+                kwargs = {} if temperature is None else {"temperature": temperature}
+                # Load tests and offline runs use the stand-in model, see helper_functions/stub_models.py
+                llm = StubChatModel() if STUB_MODELS else ChatOpenAI(model=model, **kwargs)
+                _llm_registry[key] = llm
+    return llm
+
+def get_qa_chain(retriever, model="gpt-4o-mini", llm=None):
+    """
+    Return the shared RetrievalQA chain for a retriever and model, creating it on first use.
+
+    Args:
+        retriever: The retriever the chain should query
+        model: The chat model used to answer, ignored if llm is given
+        llm: Optional chat model instance to use instead of the shared ChatOpenAI client
+
+    Returns:
+        RetrievalQA: The chain using the "stuff" strategy
+    """
+    # The chain keeps its retriever and llm alive, so their ids cannot be reused while it is registered
+    key = (id(retriever), model if llm is None else id(llm))
+    with _registry_lock:
+        entry = _qa_chain_registry.get(key)
+        if entry is not None and entry[0] is retriever:
+            _qa_chain_registry.move_to_end(key)
+            return entry[1]
+
+    # Looked up before taking the lock, which get_chat_llm takes as well and is not reentrant
+    chain_llm = llm if llm is not None else get_chat_llm(model)
+    with _registry_lock:
+        entry = _qa_chain_registry.get(key)
+        if entry is None or entry[0] is not retriever:
+            # langchain.chains is slow to import, so it is only loaded with the first chain
+            from langchain.chains import RetrievalQA
+            qa_chain = RetrievalQA.from_chain_type(
+                llm=chain_llm,
+                retriever=retriever,
+                chain_type="stuff"
+            )
+            entry = _qa_chain_registry[key] = (retriever, qa_chain)
+        _qa_chain_registry.move_to_end(key)
+        while len(_qa_chain_registry) > QA_CHAIN_CACHE_SIZE:
+            _qa_chain_registry.popitem(last=False)
+    return entry[1]
+
+
+# Event loop for running the async chain APIs from synchronous code.
+# The shared clients keep their async HTTP connections bound to the loop that opened them,
+# so every coroutine submitted from sync code runs on this one long-lived loop instead of a new one per call.
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+def run_coroutine(coroutine):
+    """Run a coroutine on the shared background event loop and wait for its result"""
+    global _background_loop
+    if _background_loop is None:
+        with _background_loop_lock:
+            if _background_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True).start()
+                _background_loop = loop
+    return asyncio.run_coroutine_threadsafe(coroutine, _background_loop).result()
+
+
+# Fallback reply when the LLM returns nothing
+NO_MATCH_RESPONSE = "I couldn't find an exact match for your query, but feel free to ask more to help me understand your query better."
+
+def stream_tokens(llm, prompt_messages):
+    """Yield the completion of prompt_messages as it is generated"""
+    streamed = False
+    for chunk in llm.stream(prompt_messages):
+        if chunk.content:
+            streamed = True
+            yield chunk.content
+    if not streamed:
+        yield NO_MATCH_RESPONSE
+
+def cache_when_complete(tokens, cache_key, prompt, start):
+    """Pass streamed tokens through, then store the complete answer in the semantic cache"""
+    chunks = []
+    for token in tokens:
+        chunks.append(token)
+        yield token
+    answer = "".join(chunks)
+    if answer != NO_MATCH_RESPONSE:
+        scope, fingerprint, embedding = cache_key
+        semantic_cache.store(scope, fingerprint, prompt, embedding, answer, time.perf_counter() - start)
 
 # Retrieve function for tax relief
-def get_chatbot_response(prompt, retriever, messages):
-  # Combine all previous messages into a single string
-  conversation_history = "\n".join([msg["content"] for msg in messages])
+# With stream=True the retrieval is done up front and a generator of response tokens is returned,
+# so the caller can render the answer as it is generated.
+# The answer is returned as the model wrote it; callers rendering markdown escape it (e.g. $ in Main.py).
+# profile is the user's form input (see capture_and_store); answers are only reused from the semantic cache
+# for near-identical questions asked with the same profile at the same point of the conversation.
+# retrieval_filter is a Chroma `where` filter restricting the retrieved chunks, e.g. to the reliefs the user is
+# eligible for; it is passed on to the retriever, which must accept it (see helper_functions/hybrid_retriever.py).
+# fingerprint identifies the content of the retriever's collection for the cache; callers pass the one they
+# hold (see current_fingerprint in helper_functions/vector_store.py), otherwise it is looked up here.
+def get_chatbot_response(prompt, retriever, messages, model="gpt-4o-mini", history_token_budget=HISTORY_TOKEN_BUDGET,
+                         stream=False, profile=None, use_cache=True, retrieval_filter=None, fingerprint=None):
+  # Imported here as the packer itself counts tokens with this module
+  from helper_functions.context_packer import pack_documents
+
+  start = time.perf_counter()
+
+  # Look for a cached answer to a near-identical question first
+  cache_key = None
+  vector_store = getattr(retriever, "vectorstore", None)
+  if use_cache and vector_store is not None:
+    previous_answer = next((msg["content"] for msg in reversed(messages) if msg.get("role") == "assistant"), None)
+    cache_key = (chat_cache_scope(profile, previous_answer),
+                 fingerprint or current_fingerprint(vector_store),
+                 vector_store.embeddings.embed_query(prompt))
+    cached_answer = semantic_cache.lookup(*cache_key)
+    if cached_answer is not None:
+      return iter([cached_answer]) if stream else cached_answer
+
+  # Keep the newest part of the conversation that fits in the token budget
+  history = build_history_window(messages, prompt, token_budget=history_token_budget)
+  conversation_history = "\n".join([msg["content"] for msg in history])
   # Prepend conversation history to the prompt
   full_prompt = f"{conversation_history}\n{prompt}"
-  
-  retriever = retriever
-  qa_chain = RetrievalQA.from_chain_type(
-      llm=ChatOpenAI(model="gpt-4o-mini"),
-      retriever=retriever,
-      chain_type="stuff"
-  )
-  vector_response = qa_chain.invoke({"query": full_prompt})
-  if vector_response and "result" in vector_response:
-    return vector_response["result"].replace("$", "\\$")
+
+  qa_chain = get_qa_chain(retriever, model=model)
+  # Only the prompt and a short context are embedded for retrieval, the history goes to the LLM alone
+  retrieval_query = build_retrieval_query(history, prompt)
+  if retrieval_filter is None:
+    documents = qa_chain.retriever.invoke(retrieval_query)
   else:
-    return "I couldn't find an exact match for your query, but feel free to ask more to help me understand your query better."
+    documents = qa_chain.retriever.invoke(retrieval_query, filter=retrieval_filter)
+
+  # Merge overlapping chunks and keep the most relevant ones within the context token budget
+  documents = pack_documents(documents)
 
+  # Fill the "stuff" prompt of the shared chain with the packed documents
+  stuff_chain = qa_chain.combine_documents_chain
+  context = stuff_chain.document_separator.join(
+      [format_document(doc, stuff_chain.document_prompt) for doc in documents]
+  )
+  prompt_messages = stuff_chain.llm_chain.prompt.format_prompt(context=context, question=full_prompt).to_messages()
+  llm = stuff_chain.llm_chain.llm
 
+  if stream:
+    tokens = stream_tokens(llm, prompt_messages)
+    return cache_when_complete(tokens, cache_key, prompt, start) if cache_key else tokens
+
+  vector_response = llm.invoke(prompt_messages)
+  if vector_response and vector_response.content:
+    response = vector_response.content
+    if cache_key:
+      scope, fingerprint, embedding = cache_key
+      semantic_cache.store(scope, fingerprint, prompt, embedding, response, time.perf_counter() - start)
+    return response
+  else:
+    return NO_MATCH_RESPONSE
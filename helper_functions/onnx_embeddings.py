@@ -0,0 +1,92 @@
+# Local sentence embeddings computed on the CPU with ONNX Runtime.
+# The model (by default all-MiniLM-L6-v2) runs in-process, so embedding a query takes a few milliseconds
+# and needs no network. Texts are tokenized with the model's own tokenizer, run through the model in
+# batches on a small thread pool, and mean-pooled over their tokens into normalised vectors.
+# The model files are read from ONNX_MODEL_DIRECTORY, and downloaded from the Hugging Face Hub only if missing.
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+import numpy as np
+import onnxruntime as ort
+from huggingface_hub import hf_hub_download
+from langchain_core.embeddings import Embeddings
+from tokenizers import Tokenizer
+
+ONNX_EMBEDDING_MODEL = os.getenv("ONNX_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+ONNX_MODEL_DIRECTORY = os.getenv("ONNX_MODEL_DIRECTORY", "./models")
+ONNX_BATCH_SIZE = int(os.getenv("ONNX_BATCH_SIZE", 32))
+ONNX_WORKERS = int(os.getenv("ONNX_WORKERS", 2))
+# Longest input in tokens; all-MiniLM-L6-v2 was trained on up to 256 tokens
+ONNX_MAX_LENGTH = int(os.getenv("ONNX_MAX_LENGTH", 256))
+
+
+def model_files(model: str = ONNX_EMBEDDING_MODEL, directory: str = ONNX_MODEL_DIRECTORY) -> Tuple[str, str]:
+    """
+    Return the paths of the ONNX model and its tokenizer.json, downloading them into directory on first use.
+    Copy the files into directory beforehand to run fully offline.
+    """
+    local_dir = os.path.join(directory, model.replace("/", "__"))
+    model_path = os.path.join(local_dir, "onnx", "model.onnx")
+    tokenizer_path = os.path.join(local_dir, "tokenizer.json")
+    if not os.path.exists(model_path):
+        hf_hub_download(repo_id=model, filename="onnx/model.onnx", local_dir=local_dir)
+    if not os.path.exists(tokenizer_path):
+        hf_hub_download(repo_id=model, filename="tokenizer.json", local_dir=local_dir)
+    return model_path, tokenizer_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """LangChain embeddings computed locally by a sentence-transformers model exported to ONNX"""
+
+    def __init__(self, model: str = ONNX_EMBEDDING_MODEL, batch_size: int = ONNX_BATCH_SIZE,
+                 workers: int = ONNX_WORKERS, max_length: int = ONNX_MAX_LENGTH):
+        self.model = model
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+
+        model_path, tokenizer_path = model_files(model)
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        # Pad each batch to its own longest text
+        self.tokenizer.enable_padding()
+
+        # The CPU cores are split between the workers, which run batches at the same time
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        token_embeddings = self.session.run(None, {name: inputs[name] for name in self.input_names})[0]
+
+        # Mean over the real tokens of each text, then scale to unit length
+        mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        # Texts of similar length are batched together, which keeps padding to a minimum
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        batches = [order[start:start + self.batch_size] for start in range(0, len(order), self.batch_size)]
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(batches))) as pool:
+            results = list(pool.map(lambda batch: self._embed_batch([texts[i] for i in batch]), batches))
+
+        # Put the vectors back in the order of the texts
+        vectors = np.empty((len(texts), results[0].shape[1]), dtype=np.float32)
+        for batch, batch_vectors in zip(batches, results):
+            vectors[batch] = batch_vectors
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        # A single text skips the thread pool
+        return self._embed_batch([text])[0].tolist()
@@ -0,0 +1,109 @@
+# Semantic cache of chatbot answers.
+# Many users ask near-identical questions, e.g. "Am I eligible for NSman relief?". Answers are stored
+# with the embedding of their question, and a new question whose embedding is close enough to a stored
+# one (cosine similarity above the threshold) gets the stored answer without retrieval or a completion.
+# Entries are scoped (see chat_cache_scope) so an answer is only reused in the same conversational context,
+# expire after a TTL, and are tied to the fingerprint of the collection they were retrieved from.
+import hashlib
+import os
+import threading
+import time
+from typing import List, Optional
+import numpy as np
+from helper_functions.sqlite_cache import open_cache
+
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", 7 * 24 * 3600))  # seconds
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    scope TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    question TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    answer TEXT NOT NULL,
+    latency REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_scope ON answers (scope, fingerprint, created_at);
+"""
+
+
+def chat_cache_scope(profile: Optional[str], previous_answer: Optional[str]) -> str:
+    """
+    Scope of a chat question: the user profile from the form and the answer the question follows on from.
+    Right after the form, the previous answer is the list of eligible reliefs, which is the same for every
+    user with that profile, so first questions are shared; a follow-up such as "tell me more" only
+    matches the same follow-up to the same answer.
+    """
+    return hashlib.sha256(f"{profile or ''}\0{previous_answer or ''}".encode("utf-8")).hexdigest()
+
+
+class SemanticCache:
+    """SQLite-backed store of answers looked up by question similarity, with hit rate and latency metrics"""
+
+    # Answers stored before they were kept unescaped (with \$ for Streamlit) are left in semantic_answers.sqlite3
+    def __init__(self, db_name: str = "semantic_answers_v2.sqlite3",
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD, ttl: float = SEMANTIC_CACHE_TTL):
+        self.db_name = db_name
+        self.threshold = threshold
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+        self._lock = threading.Lock()
+
+    def lookup(self, scope: str, fingerprint: str, embedding: List[float]) -> Optional[str]:
+        """Return the stored answer of the most similar question in the scope, or None below the threshold"""
+        with open_cache(self.db_name, _SCHEMA) as connection:
+            rows = connection.execute(
+                "SELECT vector, answer, latency FROM answers WHERE scope = ? AND fingerprint = ? AND created_at > ?",
+                (scope, fingerprint, time.time() - self.ttl)
+            ).fetchall()
+
+        answer, latency = None, 0.0
+        if rows:
+            vectors = np.stack([np.frombuffer(row[0], dtype=np.float32) for row in rows])
+            query = np.asarray(embedding, dtype=np.float32)
+            similarities = vectors @ query / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query) + 1e-12)
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                answer, latency = rows[best][1], rows[best][2]
+
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.latency_saved += latency
+        return answer
+
+    def store(self, scope: str, fingerprint: str, question: str, embedding: List[float], answer: str, latency: float) -> None:
+        """
+        Store an answer with the time it took to produce, which is counted as saved on every hit.
+        Answers from other versions of the collection and expired answers are removed at the same time.
+        """
+        with open_cache(self.db_name, _SCHEMA) as connection:
+            connection.execute(
+                "DELETE FROM answers WHERE fingerprint != ? OR created_at <= ?",
+                (fingerprint, time.time() - self.ttl)
+            )
+            connection.execute(
+                "INSERT INTO answers (scope, fingerprint, question, vector, answer, latency, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (scope, fingerprint, question, np.asarray(embedding, dtype=np.float32).tobytes(), answer, latency, time.time())
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "latency_saved_seconds": round(self.latency_saved, 3),
+            }
+
+
+# Shared by every chat session in the process
+semantic_cache = SemanticCache()
@@ -0,0 +1,30 @@
+# Shared helper for the local SQLite files used as persistent caches.
+# Each use opens its own short-lived connection, so the caches can be used from any thread.
+import os
+import sqlite3
+from contextlib import contextmanager
+
+CACHE_DIRECTORY = os.getenv("CACHE_DIRECTORY", "./cache")
+
+@contextmanager
+def open_cache(db_name, schema):
+    """
+    Open (and create if needed) a cache database in CACHE_DIRECTORY.
+
+    Args:
+        db_name: File name of the database, e.g. "guidelines.sqlite3"
+        schema: SQL script creating the tables and indexes if they do not exist
+
+    Yields:
+        sqlite3.Connection: A connection in WAL mode, so readers are not blocked by a writer.
+        The transaction is committed when the block exits normally and the connection is always closed.
+    """
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    connection = sqlite3.connect(os.path.join(CACHE_DIRECTORY, db_name), timeout=30)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(schema)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
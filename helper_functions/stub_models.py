@@ -0,0 +1,82 @@
+# Stand-in chat model and embeddings for load tests and offline runs.
+# With TAXEASE_STUB_MODELS=1 get_chat_llm returns StubChatModel and every collection is queried with
+# StubEmbeddings, so the service can be exercised end to end without API keys, cost or rate limits.
+# The stub answers after a fixed delay and then streams its tokens at a fixed rate, which keeps load
+# test results comparable between runs; the delays are set with the STUB_* environment variables below.
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+STUB_MODELS = os.getenv("TAXEASE_STUB_MODELS") == "1"
+
+# Seconds before the first token, and between the following ones
+STUB_FIRST_TOKEN_LATENCY = float(os.getenv("STUB_FIRST_TOKEN_LATENCY", 0.5))
+STUB_TOKEN_LATENCY = float(os.getenv("STUB_TOKEN_LATENCY", 0.02))
+STUB_ANSWER_TOKENS = int(os.getenv("STUB_ANSWER_TOKENS", 100))
+# Must match the dimension of the collections' embeddings, 1536 for text-embedding-3-small
+STUB_EMBEDDING_SIZE = int(os.getenv("STUB_EMBEDDING_SIZE", 1536))
+
+STUB_ANSWER_WORDS = "This is a stub answer from the TaxEase load test model .".split()
+
+
+class StubChatModel(BaseChatModel):
+    """Chat model answering every prompt with the same canned text, with the latency of a remote model"""
+
+    model_name: str = "stub"
+    first_token_latency: float = STUB_FIRST_TOKEN_LATENCY
+    token_latency: float = STUB_TOKEN_LATENCY
+    answer_tokens: int = STUB_ANSWER_TOKENS
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _tokens(self) -> List[str]:
+        return [STUB_ANSWER_WORDS[i % len(STUB_ANSWER_WORDS)] + " " for i in range(self.answer_tokens)]
+
+    def _result(self) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self._tokens())))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.first_token_latency + self.token_latency * (self.answer_tokens - 1))
+        return self._result()
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.first_token_latency + self.token_latency * (self.answer_tokens - 1))
+        return self._result()
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_latency)
+        for i, token in enumerate(self._tokens()):
+            if i:
+                time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.first_token_latency)
+        for i, token in enumerate(self._tokens()):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def create_stub_embeddings() -> DeterministicFakeEmbedding:
+    """Embeddings derived from a hash of the text, so a repeated question gets the same vector"""
+    return DeterministicFakeEmbedding(size=STUB_EMBEDDING_SIZE)
@@ -0,0 +1,139 @@
+# Process-wide registry of the Chroma vector stores used by the app.
+# Opening a collection starts a Chroma client and loads its HNSW index from disk,
+# so each collection is opened once per process and shared by every session and pipeline.
+# Refer to the generate_chroma_db_for_*.py scripts at the root folder to create the collections.
+# Each collection records the embedding backend it was built with in its metadata ("embedding_backend"),
+# and queries are embedded with that same backend: "openai" (remote API) or "onnx" (local CPU model).
+# With TAXEASE_STUB_MODELS=1 every collection is queried with the "stub" backend instead (see helper_functions/stub_models.py).
+import hashlib
+import os
+import re
+import threading
+import time
+import chromadb
+from langchain_chroma import Chroma
+from langchain_openai import OpenAIEmbeddings
+from helper_functions.embedding_cache import CachedEmbeddings
+from helper_functions.stub_models import STUB_MODELS
+
+PERSIST_DIRECTORY = "./chroma_langchain_db"
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+EMBEDDING_BACKENDS = ("openai", "onnx", "stub")
+# Backend of collections that do not record one, and of new collections built by the generator scripts
+DEFAULT_EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+# Reading a fingerprint lists every chunk id of the collection, so it is recomputed at most this often (seconds);
+# a collection re-ingested by another process, e.g. a generator script, is picked up within this interval
+FINGERPRINT_CHECK_INTERVAL = float(os.getenv("VECTOR_STORE_FINGERPRINT_INTERVAL", 60.0))
+
+_vector_stores = {}
+_embeddings = {}
+_vector_store_lock = threading.Lock()
+
+def _create_embeddings(backend):
+    if backend == "openai":
+        # Query embeddings go through the persistent cache, so repeated questions skip the API
+        return CachedEmbeddings(OpenAIEmbeddings(model=EMBEDDING_MODEL))
+    if backend == "onnx":
+        # Imported here so the OpenAI-only setup does not load onnxruntime
+        from helper_functions.onnx_embeddings import OnnxEmbeddings
+        return OnnxEmbeddings()
+    if backend == "stub":
+        from helper_functions.stub_models import create_stub_embeddings
+        return create_stub_embeddings()
+    raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {EMBEDDING_BACKENDS}")
+
+def get_embeddings(backend=DEFAULT_EMBEDDING_BACKEND):
+    """Return the shared embeddings object of a backend; a local model is loaded once and shared by all collections"""
+    embeddings = _embeddings.get(backend)
+    if embeddings is None:
+        with _vector_store_lock:
+            embeddings = _embeddings.get(backend)
+            if embeddings is None:
+                embeddings = _embeddings[backend] = _create_embeddings(backend)
+    return embeddings
+
+def collection_embedding_backend(collection_name, persist_directory=PERSIST_DIRECTORY):
+    """
+    Return the embedding backend of a collection: the EMBEDDING_BACKEND_<COLLECTION NAME> environment variable
+    if set (e.g. EMBEDDING_BACKEND_RENTAL_INFO=onnx), else the backend recorded when the collection was built.
+    Collections built before backends were recorded used OpenAI.
+    """
+    if STUB_MODELS:
+        return "stub"
+    override = os.getenv("EMBEDDING_BACKEND_" + re.sub(r"\W", "_", collection_name).upper())
+    if override:
+        return override
+    try:
+        metadata = chromadb.PersistentClient(path=persist_directory).get_collection(collection_name).metadata
+    except Exception:
+        return DEFAULT_EMBEDDING_BACKEND
+    return (metadata or {}).get("embedding_backend", "openai")
+
+def get_vector_store(collection_name):
+    """Return the shared Chroma vector store for a collection, opening it on first use"""
+    vector_store = _vector_stores.get(collection_name)
+    if vector_store is None:
+        embeddings_model = get_embeddings(collection_embedding_backend(collection_name))
+        with _vector_store_lock:
+            vector_store = _vector_stores.get(collection_name)
+            if vector_store is None:
+                vector_store = Chroma(
+                    collection_name=collection_name,
+                    embedding_function=embeddings_model,
+                    persist_directory=PERSIST_DIRECTORY
+                )
+                _vector_stores[collection_name] = vector_store
+    return vector_store
+
+def warm_up_vector_store(collection_name, query="tax"):
+    """
+    Open the collection and run one search, which loads the HNSW index into memory and opens the
+    connection to the embeddings API (or loads the local model), so the first real query does not pay for either.
+    """
+    get_vector_store(collection_name).similarity_search(query, k=1)
+
+def is_vector_store_loaded(collection_name):
+    return collection_name in _vector_stores
+
+def vector_store_fingerprint(vector_store):
+    """
+    Return a digest identifying the current content of a Chroma vector store's collection.
+    The generator scripts give every chunk an id derived from its content (see helper_functions/ingestion.py),
+    so the fingerprint changes exactly when chunks are added, changed or removed.
+    """
+    collection = vector_store._collection
+    digest = hashlib.sha256(str(collection.id).encode())
+    for chunk_id in sorted(collection.get(include=[])["ids"]):
+        digest.update(chunk_id.encode())
+    return digest.hexdigest()
+
+# Collection id -> (fingerprint, monotonic time of the next check)
+_fingerprints = {}
+_fingerprint_lock = threading.Lock()
+
+def current_fingerprint(vector_store):
+    """
+    Return the fingerprint of a vector store's collection, see vector_store_fingerprint.
+    It is computed on first use and recomputed at most every FINGERPRINT_CHECK_INTERVAL seconds,
+    or on the next call after forget_fingerprint.
+    """
+    key = str(vector_store._collection.id)
+    cached = _fingerprints.get(key)
+    if cached is not None and time.monotonic() < cached[1]:
+        return cached[0]
+    with _fingerprint_lock:
+        cached = _fingerprints.get(key)
+        if cached is not None and time.monotonic() < cached[1]:
+            return cached[0]
+        fingerprint = vector_store_fingerprint(vector_store)
+        _fingerprints[key] = (fingerprint, time.monotonic() + FINGERPRINT_CHECK_INTERVAL)
+        return fingerprint
+
+def forget_fingerprint(vector_store):
+    """Recompute the fingerprint of the collection on its next use, e.g. after chunks were added or deleted"""
+    _fingerprints.pop(str(vector_store._collection.id), None)
+
+def collection_fingerprint(collection_name):
+    """Return the fingerprint of a collection by name, see current_fingerprint"""
+    return current_fingerprint(get_vector_store(collection_name))
@@ -1,26 +1,242 @@
-import streamlit as st
+# The relief engine: eligibility lookup from the relief table and the texts shown for a profile.
+# It does not depend on Streamlit, so the app, api.py, scripts and benchmarks all use the same code.
+# The table is loaded once per process into an immutable ReliefTable shared by every session and caller,
+# and reloaded when the CSV file changes on disk.
+# The answer for every profile the form can submit is precomputed by build_relief_lookup.py at the root folder,
+# so a form submission is a single dict lookup; without an artifact matching the CSV, it is computed at load time.
+import hashlib
+import io
+import itertools
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
+from typing import Dict, Mapping, NamedTuple, Optional, Tuple
 import pandas as pd
 
 
 # Path to read the relief table in csv format
 filepath = './data/relief_table.csv'
 
+# The profile attributes captured by the form, in the same order as the columns of the relief table
+profile_columns = ['citizenship', 'gender', 'maritial_status', 'employment', 'children']
+
+# Precomputed answers for every profile, written by build_relief_lookup.py
+lookup_path = './data/relief_lookup.json'
+
+# Minimum seconds between two checks of the CSV file for changes, so lookups do not stat it every time
+RELOAD_CHECK_INTERVAL = float(os.getenv("RELIEF_TABLE_CHECK_INTERVAL", 1.0))
+
 # Function to load data
-@st.cache_data
-def load_data():
-    return pd.read_csv(filepath) 
+def load_data(source=filepath):
+    return pd.read_csv(source) 
 
-# Check if 'df' is already in session state, if not, load it
-if 'relief_df' not in st.session_state:
-    st.session_state.relief_df = load_data()  # Persist the DataFrame in session_state
 
-# Access the persisted DataFrame
-relief_df = st.session_state.relief_df
+def build_relief_index(df):
+    """
+    Precompile the relief table into an integer-keyed lookup structure.
 
-# The function to filter and return column names with value == 1
-def filter_and_get_reliefs(citizenship=None, gender=None, maritial_status=None, employment=None, children=None):
+    Each relief column is assigned one bit (in alphabetical order, so decoding a mask yields a
+    sorted list). Every row is then registered under all 2^5 variants of its profile tuple where
+    any subset of the attributes is replaced by None, i.e. a wildcard for a question left blank.
+    The bitmasks of rows sharing a key are OR-ed together at load time.
+
+    Args:
+        df: The relief table with the profile columns followed by one 0/1 column per relief
+
+    Returns:
+        tuple: (relief_names, index) where index maps a profile tuple to a relief bitmask
+    """
+    relief_names = tuple(sorted(column for column in df.columns if column not in profile_columns))
+    relief_bits = {name: 1 << bit for bit, name in enumerate(relief_names)}
+
+    index = {}
+    for record in df.to_dict('records'):
+        mask = 0
+        for name in relief_names:
+            if record[name] == 1:
+                mask |= relief_bits[name]
+
+        profile = tuple(record[column] for column in profile_columns)
+        # Enumerate every combination of wildcards for this row
+        for wildcards in range(1 << len(profile_columns)):
+            key = tuple(None if wildcards & (1 << i) else value for i, value in enumerate(profile))
+            index[key] = index.get(key, 0) | mask
+
+    return relief_names, index
+
+
+def decode_relief_mask(relief_names, mask):
+    """Return the sorted relief names whose bits are set in mask"""
+    return [name for bit, name in enumerate(relief_names) if mask & (1 << bit)]
+
+
+def profile_key(citizenship=None, gender=None, maritial_status=None, employment=None, children=None):
+    """Key of a profile in the lookups; blank answers are treated as wildcards, as in the sequential pandas filter"""
+    return tuple(value or None for value in (citizenship, gender, maritial_status, employment, children))
+
+
+def profile_keys(df):
+    """Every profile the form can submit, as keys: each combination of options, with questions left blank as None"""
+    domains = [[None] + sorted(df[column].unique().tolist()) for column in profile_columns]
+    return list(itertools.product(*domains))
+
+
+def render_relief_response(eligible_relief):
+    """The reply shown for the reliefs of a profile, or for no matching row when eligible_relief is None"""
+    # If at least one row of the relief table matches the profile, list the applicable reliefs
+    if eligible_relief is not None:
+        # Join the reliefs with bullet points
+        reliefs_bulleted = "\n\n"+"\n\n".join([f"• {relief}" for relief in eligible_relief])
+        response = f"""
+        Based on your inputs, you're eligible for the following tax reliefs:
+        
+        {reliefs_bulleted}\n\nWould you like to find out more about any of the relief types listed above?
+        """        
+        return response
+    else:
+        return f'No matching tax relief was found. 😕'
+
+
+class ReliefAnswer(NamedTuple):
+    """The eligible reliefs of a profile (None if no row matches it) and the reply of filter_and_get_reliefs"""
+    reliefs: Optional[Tuple[str, ...]]
+    response: str
+
+
+def compute_relief_lookup(df) -> Dict[tuple, ReliefAnswer]:
+    """Answer every profile of profile_keys from the bitmask index of the relief table"""
+    relief_names, index = build_relief_index(df)
+    answers = {}
+    lookup = {}
+    for key in profile_keys(df):
+        mask = index.get(key)
+        # Profiles with the same reliefs share one answer
+        if mask not in answers:
+            reliefs = None if mask is None else tuple(decode_relief_mask(relief_names, mask))
+            answers[mask] = ReliefAnswer(reliefs, render_relief_response(reliefs))
+        lookup[key] = answers[mask]
+    return lookup
+
+
+def csv_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def dump_relief_lookup(lookup: Dict[tuple, ReliefAnswer], digest: str) -> Dict:
+    """
+    Serialise a lookup for lookup_path: the distinct answers once each, and for every profile the position
+    of its answer, keyed by its answers joined with "|" (a question left blank is an empty string)
+    """
+    if any("|" in value for key in lookup for value in key if value):
+        raise ValueError('Profile answers must not contain "|"')
+    answers = list(dict.fromkeys(lookup.values()))
+    positions = {answer: position for position, answer in enumerate(answers)}
+    return {
+        "csv_sha256": digest,
+        "profile_columns": profile_columns,
+        "answers": [{"reliefs": None if answer.reliefs is None else list(answer.reliefs), "response": answer.response}
+                    for answer in answers],
+        "profiles": {"|".join(value or "" for value in key): positions[answer] for key, answer in lookup.items()},
+    }
+
+
+def read_relief_lookup(path: str, digest: str) -> Optional[Dict[tuple, ReliefAnswer]]:
+    """Read the lookup written by build_relief_lookup.py, or None if it is missing or was built from another CSV"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("csv_sha256") != digest or data.get("profile_columns") != profile_columns:
+        return None
+    answers = [ReliefAnswer(None if answer["reliefs"] is None else tuple(answer["reliefs"]), answer["response"])
+               for answer in data["answers"]]
+    return {tuple(value or None for value in key.split("|")): answers[position]
+            for key, position in data["profiles"].items()}
+
+
+class ReliefTable(NamedTuple):
+    """
+    A loaded relief table with the answer for every profile (see compute_relief_lookup).
+    Shared by every caller, so it must not be modified; a reload replaces it with a new ReliefTable.
+    """
+    df: pd.DataFrame
+    lookup: Mapping[tuple, ReliefAnswer]
+    # SHA-256 of the CSV file, which the precomputed lookup must have been built from
+    csv_sha256: str
+    # (st_mtime_ns, st_size) of the CSV file it was loaded from
+    file_version: Tuple[int, int]
+
+
+def _file_version(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _load_relief_table(file_version):
+    # The bytes are read once, so the digest is that of the table actually parsed
+    with open(filepath, "rb") as f:
+        data = f.read()
+    df = load_data(io.BytesIO(data))
+    digest = csv_digest(data)
+    lookup = read_relief_lookup(lookup_path, digest)
+    if lookup is None:
+        # The CSV was changed without running build_relief_lookup.py, or the artifact is missing
+        lookup = compute_relief_lookup(df)
+    return ReliefTable(df, MappingProxyType(lookup), digest, file_version)
+
+
+_relief_table = None
+_next_check = 0.0
+_relief_table_lock = threading.Lock()
+
+def get_relief_table():
+    """
+    Return the shared ReliefTable, loading it on first use and reloading it when the CSV file has changed.
+    The file is checked at most every RELOAD_CHECK_INTERVAL seconds. Callers keep the table they were given
+    for the whole of a lookup, so a reload never mixes an old and a new table.
+    """
+    global _relief_table, _next_check
+    table = _relief_table
+    if table is not None and time.monotonic() < _next_check:
+        return table
+    with _relief_table_lock:
+        if _relief_table is not None and time.monotonic() < _next_check:
+            return _relief_table
+        try:
+            file_version = _file_version(filepath)
+            if _relief_table is None or file_version != _relief_table.file_version:
+                _relief_table = _load_relief_table(file_version)
+        except (OSError, ValueError):
+            # A file being rewritten may be missing or unreadable for a moment: keep serving the loaded table
+            if _relief_table is None:
+                raise
+        _next_check = time.monotonic() + RELOAD_CHECK_INTERVAL
+        return _relief_table
+
+
+def get_eligible_reliefs(citizenship=None, gender=None, maritial_status=None, employment=None, children=None):
+    """
+    Look up the reliefs applicable to a (possibly partial) profile in the precomputed answers.
+
+    Returns:
+        list: Sorted relief names, or None if no row in the relief table matches the profile
+    """
+    entry = get_relief_table().lookup.get(profile_key(citizenship, gender, maritial_status, employment, children))
+    if entry is None or entry.reliefs is None:
+        return None
+    return list(entry.reliefs)
+
+
+def get_eligible_reliefs_pandas(df, citizenship=None, gender=None, maritial_status=None, employment=None, children=None):
+    """
+    Reference implementation of the relief lookup using chained pandas filters.
+    Kept for benchmarking and for checking the precompiled index against the relief table.
+    """
     # Start with the full DataFrame and apply filters only if the corresponding parameter is provided
-    filtered_df = relief_df
+    filtered_df = df
     
     # The following sequential approach ensures that if any of the 5 criteria isn't provided, the filtering will still work
     if citizenship:
@@ -34,26 +250,24 @@ def filter_and_get_reliefs(citizenship=None, gender=None, maritial_status=None,
     if children:
         filtered_df = filtered_df[filtered_df['children'] == children]
 
-    # If the filtered DataFrame is not empty, find the columns where value == 1
-    if not filtered_df.empty:
-        # Iterate over all rows in the filtered DataFrame and get the columns with value == 1
-        relief_columns = set()  # Use a set to avoid duplicates
-        for _, row in filtered_df.iterrows():
-            # Add all column names where value == 1 to the set
-            relief_columns.update(row[row == 1].index.tolist())
-            
-        # sort the list of applicable reliefs
-        eligible_relief = sorted(list(relief_columns))
-        # Join the reliefs with bullet points
-        reliefs_bulleted = "\n\n"+"\n\n".join([f"• {relief}" for relief in eligible_relief])
-        response = f"""
-        Based on your inputs, you're eligible for the following tax reliefs:
-        
-        {reliefs_bulleted}\n\nWould you like to find out more about any of the relief types listed above?
-        """        
-        return response
-    else:
-        return f'No matching tax relief was found. 😕'
+    if filtered_df.empty:
+        return None
+
+    # Iterate over all rows in the filtered DataFrame and get the columns with value == 1
+    relief_columns = set()  # Use a set to avoid duplicates
+    for _, row in filtered_df.iterrows():
+        # Add all column names where value == 1 to the set
+        relief_columns.update(row[row == 1].index.tolist())
+
+    # sort the list of applicable reliefs
+    return sorted(list(relief_columns))
+
+
+# The function to filter and return column names with value == 1
+def filter_and_get_reliefs(citizenship=None, gender=None, maritial_status=None, employment=None, children=None):
+    entry = get_relief_table().lookup.get(profile_key(citizenship, gender, maritial_status, employment, children))
+    # Answers outside the options of the form match no row of the relief table
+    return entry.response if entry is not None else render_relief_response(None)
 
 
 # The function to captures the inputs from the user to be provided to the LLM as context
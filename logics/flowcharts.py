@@ -57,10 +57,9 @@ def display_rental_income_flowchart():
         
         QAChain --> FetchGuidelines[Fetch Tax Guidelines]
         FetchGuidelines --> Guidelines1[Tax Deduction Guidelines]
-        FetchGuidelines --> Guidelines2[Computation Guidelines]
-        FetchGuidelines --> Guidelines3[Strategy Guidelines]
+        FetchGuidelines --> Guidelines2[Strategy Guidelines]
         
-        Guidelines1 & Guidelines2 & Guidelines3 --> CreateChains[Create LangChain Components]
+        Guidelines1 & Guidelines2 --> CreateChains[Create LangChain Components]
         
         CreateChains --> TaxSpecialist[Tax Specialist Chain]
         TaxSpecialist --> |Analyse Expenses| ExpenseAnalysis[["For each property:
@@ -69,8 +68,8 @@ def display_rental_income_flowchart():
             - Perform tax research if needed
             - Categorise expenses"]]
         
-        ExpenseAnalysis --> RentComputation[Rent Computation Chain]
-        RentComputation --> |Calculate Methods| Methods[["Calculate using:
+        ExpenseAnalysis --> RentComputation[Rent Computation Engine]
+        RentComputation --> |Calculate Methods| Methods[["Calculate exactly using:
             1. Actual Expense Method:
                 - Subtract allowable expenses
                 - Apply ownership share
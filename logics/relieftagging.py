@@ -0,0 +1,106 @@
+# Tagging of the tax relief chunks with the reliefs they cover, for profile-aware retrieval.
+# data/type_of_reliefs.txt has one section per relief, each starting with a heading line. Every chunk is
+# tagged with the reliefs of the sections it overlaps, as one boolean metadata flag per relief (Chroma
+# metadata values cannot be lists); chunks before the first relief section get the general flag.
+# Once the user's eligible reliefs are known, retrieval is restricted to their chunks plus the general ones.
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+from langchain_core.documents import Document
+
+GENERAL_KEY = "relief_general"
+
+# Heading lines opening the section of each relief, named as in the columns of data/relief_table.csv
+RELIEF_SECTION_HEADINGS = [
+    (r"Earned Income Relief$", ["Earned Income Relief"]),
+    (r"Spouse Relief/", ["Spouse Relief"]),
+    (r"Foreign Domestic Worker Levy \(FDWL\) Relief$", ["Foreign Domestic Worker Levy Relief"]),
+    (r"Central Provident Fund \(CPF\) Relief for employees$", ["CPF Relief for Employees"]),
+    (r"Central Provident Fund \(CPF\) relief for self-employed", ["CPF Relief for Self-Employed"]),
+    (r"NSman Relief \(Self\), NSman Relief \(Wife\) and NSman Relief \(Parent\)$",
+     ["NSman (Self) Relief", "NSman (Wife) Relief", "NSman (Parent) Relief"]),
+    (r"NSman Self Relief$", ["NSman (Self) Relief"]),
+    (r"NSman Wife Relief$", ["NSman (Wife) Relief"]),
+    (r"NSman Parent Relief$", ["NSman (Parent) Relief"]),
+    (r"Parent Relief/Parent Relief \(Disability\)$", ["Parent Relief"]),
+    (r"Grandparent Caregiver Relief$", ["Grandparent Caregiver Relief"]),
+    (r"Sibling Relief \(Disability\)$", ["Sibling Relief"]),
+    (r"Working Mother's Child Relief \(WMCR\)$", ["Working Mother's Child Relief"]),
+    (r"Qualifying Child Relief \(QCR\)", ["Qualifying Child Relief"]),
+    (r"Life Insurance Relief$", ["Life Insurance Relief"]),
+    (r"Course Fees Relief$", ["Course Fees Relief"]),
+    (r"SRS contributions and tax relief$", ["SRS Relief"]),
+    (r"Central Provident Fund \(CPF\) Cash Top-up Relief$", ["CPF Cash Top-up Relief"]),
+    (r"Compulsory and voluntary MediSave contributions$",
+     ["CPF Relief (Compulsory and Voluntary Medisave Contribution)"]),
+]
+
+
+def relief_key(relief_name: str) -> str:
+    """Metadata key of a relief's flag, e.g. "relief_working_mother_s_child_relief" """
+    return "relief_" + re.sub(r"\W+", "_", relief_name.lower()).strip("_")
+
+
+def relief_sections(text: str) -> List[Tuple[int, List[str]]]:
+    """Return the (offset, relief names) of every section heading in the text, in order"""
+    patterns = [(re.compile(pattern), names) for pattern, names in RELIEF_SECTION_HEADINGS]
+    sections = []
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        heading = line.strip().replace("’", "'")
+        for pattern, names in patterns:
+            if pattern.match(heading):
+                sections.append((offset, names))
+                break
+        offset += len(line)
+    return sections
+
+
+def reliefs_in_span(sections: List[Tuple[int, List[str]]], start: int, end: int) -> List[str]:
+    """Relief names of the sections overlapping text[start:end]"""
+    names = []
+    for i, (section_start, section_names) in enumerate(sections):
+        section_end = sections[i + 1][0] if i + 1 < len(sections) else float("inf")
+        if section_start < end and start < section_end:
+            names += [name for name in section_names if name not in names]
+    return names
+
+
+def tag_relief_chunks(documents: List[Document], chunks: List[Document]) -> List[Document]:
+    """
+    Add the relief flags to the metadata of chunks split from documents (matched on their "source").
+    Chunks are located in their document in order, so overlapping chunks are placed correctly.
+    """
+    texts = {doc.metadata.get("source"): doc.page_content for doc in documents}
+    sections = {source: relief_sections(text) for source, text in texts.items()}
+    search_from = {}
+
+    for chunk in chunks:
+        source = chunk.metadata.get("source")
+        text = texts[source]
+        start = text.find(chunk.page_content, search_from.get(source, 0))
+        if start < 0:
+            start = text.find(chunk.page_content)
+        search_from[source] = start + 1
+
+        names = reliefs_in_span(sections[source], start, start + len(chunk.page_content)) if start >= 0 else []
+        if names:
+            chunk.metadata.update({relief_key(name): True for name in names})
+        else:
+            chunk.metadata[GENERAL_KEY] = True
+    return chunks
+
+
+def is_relief_tagged(metadatas: Iterable[Dict]) -> bool:
+    """Whether a collection's chunks carry relief flags; collections built before tagging do not"""
+    return any(key.startswith("relief_") for metadata in metadatas for key in metadata or {})
+
+
+def relief_filter(relief_names: Optional[Iterable[str]]) -> Optional[Dict]:
+    """
+    Chroma `where` filter keeping the chunks of the given reliefs and the general chunks.
+    Returns None (no filter) when the eligible reliefs are unknown.
+    """
+    if relief_names is None:
+        return None
+    conditions = [{relief_key(name): True} for name in relief_names] + [{GENERAL_KEY: True}]
+    return conditions[0] if len(conditions) == 1 else {"$or": conditions}
@@ -0,0 +1,136 @@
+# Batch rental analysis for many client portfolios at once.
+# The vector store, the guideline answers, the LLM client and the analysis chain are set up once
+# and shared by every portfolio; the portfolios themselves are analysed concurrently.
+from typing import List, Dict, Tuple
+import asyncio
+import json
+import os
+import time
+import pandas as pd
+from helper_functions.llm import run_coroutine
+from helper_functions.vector_store import collection_fingerprint
+from logics.rentalcalculatorlangchain import (RENTAL_COLLECTION, get_qa_chain, afetch_guidelines,
+                                             create_analysis_chains, create_sequential_chain,
+                                             build_analysis_inputs)
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+
+EXPENSE_COLUMNS = ["Category", "Amount", "Description"]
+
+
+def property_from_record(record: Dict) -> Dict:
+    """Build a property dictionary in the same shape as st.session_state.properties"""
+    return {
+        "rental_income": float(record.get("rental_income") or 0.0),
+        "is_co_owned": bool(record.get("is_co_owned", False)),
+        "ownership_share": float(record.get("ownership_share") or 0.0),
+        "expenses": pd.DataFrame(record.get("expenses") or [], columns=EXPENSE_COLUMNS),
+    }
+
+
+def load_portfolios_jsonl(path: str) -> List[Tuple[str, List[Dict]]]:
+    """
+    Read portfolios from a JSONL file, one portfolio per line, e.g.
+    {"portfolio_id": "C001", "properties": [{"rental_income": 36000, "is_co_owned": true, "ownership_share": 50,
+      "expenses": [{"Category": "Mortgage Loan Interest", "Amount": 8000, "Description": ""}]}]}
+    """
+    portfolios = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            portfolio_id = str(record.get("portfolio_id", line_number))
+            portfolios.append((portfolio_id, [property_from_record(prop) for prop in record["properties"]]))
+    return portfolios
+
+
+def load_portfolios_csv(path: str) -> List[Tuple[str, List[Dict]]]:
+    """
+    Read portfolios from a CSV file with one row per expense and the columns
+    portfolio_id, property, rental_income, is_co_owned, ownership_share, category, amount, description.
+    A property without expenses is given as a single row with an empty category.
+    """
+    df = pd.read_csv(path, dtype={"portfolio_id": str})
+    portfolios = []
+    for portfolio_id, portfolio_rows in df.groupby("portfolio_id", sort=False):
+        properties = []
+        for _, property_rows in portfolio_rows.groupby("property", sort=False):
+            first = property_rows.iloc[0]
+            expenses = property_rows[property_rows["category"].notna()]
+            properties.append(property_from_record({
+                "rental_income": first["rental_income"],
+                "is_co_owned": str(first["is_co_owned"]).strip().lower() in ("true", "1", "yes"),
+                "ownership_share": first["ownership_share"] if pd.notna(first["ownership_share"]) else 0.0,
+                "expenses": [
+                    {"Category": row["category"], "Amount": row["amount"],
+                     "Description": row["description"] if pd.notna(row["description"]) else ""}
+                    for _, row in expenses.iterrows()
+                ],
+            }))
+        portfolios.append((portfolio_id, properties))
+    return portfolios
+
+
+def load_portfolios(path: str) -> List[Tuple[str, List[Dict]]]:
+    """Read portfolios from a .csv or .jsonl file"""
+    if path.lower().endswith(".csv"):
+        return load_portfolios_csv(path)
+    return load_portfolios_jsonl(path)
+
+
+async def arun_batch_analysis(portfolios: List[Tuple[str, List[Dict]]], output_path: str,
+                              max_concurrency: int = BATCH_CONCURRENCY) -> Dict:
+    """
+    Analyse many portfolios with one shared set of resources, writing each report as soon as it is ready.
+
+    Args:
+        portfolios: (portfolio_id, property_list) pairs, e.g. from load_portfolios
+        output_path: JSONL file receiving one {"portfolio_id", "report"} or {"portfolio_id", "error"} line per portfolio
+        max_concurrency: Maximum number of portfolios analysed at the same time
+
+    Returns:
+        dict: Counts of completed and failed portfolios and the elapsed time
+    """
+    start = time.perf_counter()
+
+    # Shared by every portfolio: the guideline answers are fetched (or read from the cache) once
+    qa_chain = await asyncio.to_thread(get_qa_chain)
+    fingerprint = await asyncio.to_thread(collection_fingerprint, RENTAL_COLLECTION)
+    guidelines = await afetch_guidelines(qa_chain, fingerprint)
+    analysis_chain = create_sequential_chain(create_analysis_chains())
+
+    completed, failed = 0, 0
+    inputs, batch_portfolios = [], []
+    with open(output_path, "w", encoding="utf-8") as f:
+        # Portfolios with a property too large for a prompt are reported as failed without calling the LLM
+        for portfolio_id, property_list in portfolios:
+            try:
+                inputs.append(build_analysis_inputs(property_list, guidelines))
+                batch_portfolios.append(portfolio_id)
+            except ValueError as e:
+                f.write(json.dumps({"portfolio_id": portfolio_id, "error": f"ValueError: {e}"}) + "\n")
+                failed += 1
+        f.flush()
+
+        async for index, result in analysis_chain.abatch_as_completed(
+            inputs, config={"max_concurrency": max_concurrency}, return_exceptions=True
+        ):
+            portfolio_id = batch_portfolios[index]
+            if isinstance(result, Exception):
+                record = {"portfolio_id": portfolio_id, "error": f"{type(result).__name__}: {result}"}
+                failed += 1
+            else:
+                record = {"portfolio_id": portfolio_id, "report": result["final_report"]}
+                completed += 1
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+
+    return {"completed": completed, "failed": failed, "seconds": round(time.perf_counter() - start, 2)}
+
+
+def run_batch_analysis(input_path: str, output_path: str, max_concurrency: int = BATCH_CONCURRENCY) -> Dict:
+    """Synchronous entry point: load the portfolios from input_path and analyse them all"""
+    portfolios = load_portfolios(input_path)
+    # Runs on the shared event loop so the async LLM connections are reused across calls
+    return run_coroutine(arun_batch_analysis(portfolios, output_path, max_concurrency))
@@ -3,18 +3,39 @@ import sys
 sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
 
 # langchain_rental.py
-from typing import List, Dict
+from typing import List, Dict, Iterator, AsyncIterator, Union
+import asyncio
 import os
+import threading
 from langchain.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain.chains import SequentialChain, LLMChain
-from langchain.chains import RetrievalQA
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
+from langchain.chains import SequentialChain, LLMChain, TransformChain
+from langchain.chains.base import Chain
 from serpapi.google_search import GoogleSearch
-from dotenv import load_dotenv
-
-load_dotenv('.env')
+from helper_functions.llm import get_chat_llm, run_coroutine, load_environment
+from helper_functions.vector_store import get_vector_store, warm_up_vector_store, is_vector_store_loaded, collection_fingerprint
+from helper_functions.hybrid_retriever import HybridRetriever
+from helper_functions.context_packer import PackedRetrievalQA
+from helper_functions.guideline_cache import get_cached_guideline, store_guideline
+from logics.rentalcomputation import compute_rental_tax, format_computation_results
+from logics.rentalserializer import chunk_properties
+
+load_environment()
+
+# Collection created by generate_chroma_db_for_rental.py
+RENTAL_COLLECTION = "rental_info"
+# The pipeline has always run on ChatOpenAI's default model
+RENTAL_MODEL = "gpt-3.5-turbo"
+
+# Fixed questions answered from the rental collection for each stage of the analysis.
+# The answers are the same for every user, so they are cached until the collection changes.
+GUIDELINE_QUERIES = {
+    "tax_guidelines": "What are the allowable and non-allowable rental expenses for tax deduction in Singapore?",
+    "strategy_guidelines": "What are the benefits and considerations for choosing between actual expense claims and simplified rental expense claims methods?",
+}
+
+# The guideline questions are independent of each other, so they are sent concurrently
+GUIDELINE_CONCURRENCY = int(os.getenv("GUIDELINE_CONCURRENCY", 3))
+GUIDELINE_TIMEOUT = float(os.getenv("GUIDELINE_TIMEOUT", 120))  # seconds per question
 
 # Create function to allow chain to obtain info from the web using google serach
 def perform_tax_research(query: str) -> dict:
@@ -48,30 +69,119 @@ def perform_tax_research(query: str) -> dict:
 
 
 def initialise_vector_store():
-    """Initialise and return the Chroma vector store"""
-    embeddings_model = OpenAIEmbeddings(model='text-embedding-3-small')
-    vector_store = Chroma(
-        collection_name="rental_info",
-        embedding_function=embeddings_model,
-        persist_directory="./chroma_langchain_db"
-    )
-    return vector_store
+    """Return the shared Chroma vector store for rental info, opening it on first use"""
+    return get_vector_store(RENTAL_COLLECTION)
 
 def create_qa_chain(vector_store):
     """Create a retrieval QA chain for tax-related queries"""
-    llm = ChatOpenAI(temperature=0)
-    return RetrievalQA.from_chain_type(
+    llm = get_chat_llm(RENTAL_MODEL, temperature=0)
+    # Retrieved chunks are merged and trimmed to a token budget before being stuffed into the prompt
+    return PackedRetrievalQA.from_chain_type(
         llm=llm,
         chain_type="stuff",
-        retriever=vector_store.as_retriever(k=5),
+        # Vector search, fused with the collection's BM25 index with RETRIEVAL_MODE=hybrid (see helper_functions/hybrid_retriever.py)
+        retriever=HybridRetriever.from_vector_store(vector_store, k=5),
         return_source_documents=True
     )
 
-def get_tax_guidelines(qa_chain, query: str) -> str:
-    """Query the vector store for tax-related information"""
+# The QA chain is built once per process and shared by every analysis
+_qa_chain = None
+_qa_chain_lock = threading.Lock()
+
+def get_qa_chain():
+    """Return the shared retrieval QA chain over the rental collection, creating it on first use"""
+    global _qa_chain
+    if _qa_chain is None:
+        with _qa_chain_lock:
+            if _qa_chain is None:
+                _qa_chain = create_qa_chain(initialise_vector_store())
+    return _qa_chain
+
+def rental_resources_health() -> Dict[str, bool]:
+    """Report which of the shared rental resources have been initialised"""
+    return {
+        "vector_store": is_vector_store_loaded(RENTAL_COLLECTION),
+        "qa_chain": _qa_chain is not None,
+    }
+
+def warm_up_rental_resources() -> Dict[str, bool]:
+    """
+    Initialise the shared rental resources ahead of the first analysis.
+    Meant to be called once at startup, e.g. from a background thread, so the first user does not pay the cold start.
+    """
+    get_qa_chain()
+    warm_up_vector_store(RENTAL_COLLECTION, query="allowable rental expenses")
+    return rental_resources_health()
+
+def get_tax_guidelines(qa_chain, query: str, fingerprint: str = None) -> str:
+    """
+    Query the vector store for tax-related information
+
+    Args:
+        qa_chain: The retrieval QA chain over the rental collection
+        query: The question to answer
+        fingerprint: Fingerprint of the rental collection; if given, the answer is read from and stored in the guideline cache
+
+    Returns:
+        str: The answer to the query
+    """
+    model = qa_chain.combine_documents_chain.llm_chain.llm.model_name
+    if fingerprint:
+        cached = get_cached_guideline(query, model, fingerprint)
+        if cached is not None:
+            return cached
+
     result = qa_chain.invoke({"query": query})
+
+    if fingerprint:
+        store_guideline(query, model, fingerprint, result["result"])
+    return result["result"]
+
+async def aget_tax_guidelines(qa_chain, query: str, fingerprint: str = None) -> str:
+    """Async version of get_tax_guidelines; the guideline cache is read and written in a thread, off the event loop"""
+    model = qa_chain.combine_documents_chain.llm_chain.llm.model_name
+    if fingerprint:
+        cached = await asyncio.to_thread(get_cached_guideline, query, model, fingerprint)
+        if cached is not None:
+            return cached
+
+    result = await qa_chain.ainvoke({"query": query})
+
+    if fingerprint:
+        await asyncio.to_thread(store_guideline, query, model, fingerprint, result["result"])
     return result["result"]
 
+async def afetch_guidelines(qa_chain, fingerprint: str = None,
+                            max_concurrency: int = GUIDELINE_CONCURRENCY,
+                            timeout: float = GUIDELINE_TIMEOUT) -> Dict[str, str]:
+    """
+    Answer all GUIDELINE_QUERIES concurrently.
+
+    Args:
+        qa_chain: The retrieval QA chain over the rental collection
+        fingerprint: Fingerprint of the rental collection, used for the guideline cache
+        max_concurrency: Maximum number of questions in flight at once
+        timeout: Seconds allowed for each question before asyncio.TimeoutError is raised
+
+    Returns:
+        dict: The answers keyed like GUIDELINE_QUERIES
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch(key):
+        async with semaphore:
+            answer = await asyncio.wait_for(aget_tax_guidelines(qa_chain, GUIDELINE_QUERIES[key], fingerprint), timeout)
+            return key, answer
+
+    return dict(await asyncio.gather(*[fetch(key) for key in GUIDELINE_QUERIES]))
+
+def fetch_guidelines(qa_chain, fingerprint: str = None) -> Dict[str, str]:
+    """
+    Answer all GUIDELINE_QUERIES concurrently from synchronous code, such as the Streamlit script.
+    Callers that already run an event loop should await afetch_guidelines instead.
+    """
+    return run_coroutine(afetch_guidelines(qa_chain, fingerprint))
+
 def create_tax_specialist_prompt() -> PromptTemplate:
     return PromptTemplate(
         input_variables=["properties_list", "tax_guidelines"],
@@ -82,7 +192,7 @@ Tax Guidelines Reference:
 
 Properties Data: {properties_list}
 
-IMPORTANT: Only analyze the exact number of properties provided in the properties_list. Do not create or assume additional properties.
+IMPORTANT: Only analyze the exact number of properties provided in the Properties Data. Do not create or assume additional properties.
 
 First, state the number of properties found in the input data.
 
@@ -111,69 +221,18 @@ Please format your response as a structured analysis of each property, including
   - Explanation if not allowable, with reference to specific guidelines or search results
 """)
 
-def create_rent_computation_prompt() -> PromptTemplate:
-    return PromptTemplate(
-        input_variables=["tax_specialist_output", "computation_guidelines"],
-        template="""You are a Rent Computation Expert calculating taxable rental income using two methods.
-
-Tax Computation Guidelines:
-{computation_guidelines}
-
-Previous Analysis: {tax_specialist_output}
-
-IMPORTANT: Only compute values for properties that were analyzed in the Previous Analysis section. Do not create or assume additional properties.
-
-Using the provided guidelines, calculate taxable rental income for each property using:
-
-    1. Actual Expense Claims Method:
-    - Subtract allowable expenses from gross rental income
-    - Apply ownership share to the result. 
-
-    2. Simplified Rental Expense Claims Method:
-    - Deduct full mortgage interest from gross rental income
-    - Deduct 15 percent of gross rental income as deemed expenses
-    - Apply ownership share to the result.
-
-        Example for Simplified Rental Expense Claims Method:
-        - Gross Rental Income = $60,000
-        - Mortgage Interest = $12,000
-        - Deemed Expenses = 15 percent of $60,000 = $9,000
-        - Taxable Rent = $60,000 - $12,000 - $9,000 = $39,000
-
-If co-ownership status is 'True:
-- Multiply the net rental income or loss by the property ownership percentage to determine the user's taxable rental income or loss.
-    Example:
-    - Gross Rental Income = $60,000
-    - Deductible Expenses = $40,000
-    - Property Ownership Share = 20%
-    - Taxable Rent: ($60,000 - $40,000) * 20% = $4,000
-
-For each actual property from the Previous Analysis, show:
-- Rental Income
-- Deductible Expenses (itemized)
-- Ownership share
-- Taxable Rent calculation
-- Non-deductible expenses with explanations
-
-Calculate total taxable rent across all properties for each method.
-Handle rental losses by offsetting against other properties' income.
-This is applicable to both Actual Expense and Simplified Reatal Expense claims method.
-    Example:
-    - Taxable Rent from Property A = $30000
-    - Taxable Rent from Property B (loss) = (-$10000)
-    - Total Taxable Rent from all properties = $30000 + (-$10000) = $20000
-
-""")
-
 def create_strategist_prompt() -> PromptTemplate:
     return PromptTemplate(
-        input_variables=["computation_results", "strategy_guidelines"],
+        input_variables=["tax_specialist_output", "computation_results", "strategy_guidelines"],
         template="""You are a Rental Income Strategist providing tax reporting advice.
 
 Tax Strategy Guidelines:
 {strategy_guidelines}
 
-Computation Results: {computation_results}
+Expense Review: {tax_specialist_output}
+
+Computation Results (computed exactly, use these figures as given and do not recalculate them):
+{computation_results}
 
 IMPORTANT: Only include properties that were analyzed in the Computation Results. Do not create or assume additional properties.
 
@@ -187,15 +246,15 @@ Create a markdown report showing:
      - Taxable Rent (show calculation steps)
      - Non-deductible expenses with explanations
    - Total taxable rent for all properties
-   - IMPORTANT: Calculate and show the exact numerical values for each method
-   - IMPORTANT: All non-deductible expenses with their respective explanations
+   - IMPORTANT: Show the exact numerical values for each method from the Computation Results
+   - IMPORTANT: All non-deductible expenses with their respective explanations from the Expense Review
+   - If the Expense Review considers an expense deductible that the Computation Results did not deduct, point it out and advise the user to confirm it with IRAS before claiming it
 
 2. Numerical Comparison and Recommendation:
    - First, explicitly state the total taxable rent for each method:
      * Actual Expense Claims Method Total: $X
      * Simplified Rental Expense Claims Method Total: $Y
-   - Perform a direct numerical comparison to determine which amount is lower
-   - IMPORTANT: Recommend the method that results in the mathematically lower taxable rent value
+   - IMPORTANT: Recommend the method that the Computation Results identify as giving the lower total taxable rent
    - Your recommendation must begin with: "Based on the numerical comparison, the [method name] results in a lower taxable rent of $[amount] compared to $[amount] for the other method."
    - Then explain benefits and considerations of the recommended method, referencing the guidelines
    - If both methods yield exactly the same numerical result, explain pros and cons without making a recommendation
@@ -204,52 +263,60 @@ Create a markdown report showing:
    - Owner's responsibility for accurate and timely tax reporting
    - Requirement to keep expense records for 5 years
 
-Mathematical Verification Steps Required:
-1. Double-check all calculations before making recommendation
-2. Verify that ownership shares are correctly applied
-3. Confirm that the recommended method truly results in the lowest numerical value
-4. Show all intermediate calculation steps
+Figures Required:
+1. Show the calculation steps exactly as they appear in the Computation Results
+2. Do not change, round differently or recompute any amount
 
 Do not use markdown code blocks in your response.""")
 
-def run_rental_analysis(property_list: List[Dict]) -> str:
-    """
-    Analyze rental properties using LangChain with vector store integration.
-    
-    Args:
-        property_list: List of property dictionaries containing rental information
-        
-    Returns:
-        str: Analysis results in markdown format
-    """
-    # Initialise vector store and QA chain
-    vector_store = initialise_vector_store()
-    qa_chain = create_qa_chain(vector_store)
-
-    # Retrieve relevant tax guidelines for each stage
-    tax_guidelines = get_tax_guidelines(qa_chain, 
-        "What are the allowable and non-allowable rental expenses for tax deduction in Singapore?")
-    computation_guidelines = get_tax_guidelines(qa_chain,
-        "How to calculate taxable rental income using actual expense claims method and simplified method?")
-    strategy_guidelines = get_tax_guidelines(qa_chain,
-        "What are the benefits and considerations for choosing between actual expense claims and simplified rental expense claims methods?")
-
-    # Initialise LLM
-    llm = ChatOpenAI(temperature=0)
-
-    # Create chains for each analysis step
-    tax_specialist_chain = LLMChain(
+def compute_rent(inputs: Dict) -> Dict[str, str]:
+    """Deterministic rent computation stage, replacing the LLM arithmetic"""
+    results = compute_rental_tax(inputs["properties"])
+    return {"computation_results": format_computation_results(results)}
+
+async def acompute_rent(inputs: Dict) -> Dict[str, str]:
+    """Async entry point of compute_rent; the computation takes microseconds so it runs inline"""
+    return compute_rent(inputs)
+
+def create_analysis_chains() -> List[Chain]:
+    """Create the chains for each analysis step, in the order they run"""
+    # Reuse the shared LLM client
+    llm = get_chat_llm(RENTAL_MODEL, temperature=0)
+
+    tax_specialist_llm_chain = LLMChain(
         llm=llm,
         prompt=create_tax_specialist_prompt(),
         output_key="tax_specialist_output",
         verbose=True
     )
 
-    rent_computation_chain = LLMChain(
-        llm=llm,
-        prompt=create_rent_computation_prompt(),
-        output_key="computation_results",
-        verbose=True
+    # Portfolios too large for one prompt are serialized in several parts (see chunk_properties);
+    # every part is reviewed separately and the reviews are joined in property order
+    def review_expenses(inputs: Dict) -> Dict[str, str]:
+        outputs = tax_specialist_llm_chain.batch([
+            {"properties_list": chunk, "tax_guidelines": inputs["tax_guidelines"]} for chunk in inputs["properties_chunks"]
+        ])
+        return {"tax_specialist_output": "\n\n".join(output["tax_specialist_output"] for output in outputs)}
+
+    async def areview_expenses(inputs: Dict) -> Dict[str, str]:
+        outputs = await tax_specialist_llm_chain.abatch([
+            {"properties_list": chunk, "tax_guidelines": inputs["tax_guidelines"]} for chunk in inputs["properties_chunks"]
+        ])
+        return {"tax_specialist_output": "\n\n".join(output["tax_specialist_output"] for output in outputs)}
+
+    tax_specialist_chain = TransformChain(
+        input_variables=["properties_chunks", "tax_guidelines"],
+        output_variables=["tax_specialist_output"],
+        transform=review_expenses,
+        atransform=areview_expenses
+    )
+
+    # The figures are computed in Python from the structured property data; the LLMs only explain them
+    rent_computation_chain = TransformChain(
+        input_variables=["properties"],
+        output_variables=["computation_results"],
+        transform=compute_rent,
+        atransform=acompute_rent
     )
 
     strategist_chain = LLMChain(
@@ -259,20 +326,106 @@ def run_rental_analysis(property_list: List[Dict]) -> str:
         verbose=True
     )
 
-    # Combine chains
-    analysis_chain = SequentialChain(
-        chains=[tax_specialist_chain, rent_computation_chain, strategist_chain],
-        input_variables=["properties_list", "tax_guidelines", "computation_guidelines", "strategy_guidelines"],
+    return [tax_specialist_chain, rent_computation_chain, strategist_chain]
+
+def create_sequential_chain(chains: List[Chain]) -> SequentialChain:
+    """Combine the analysis chains into a single chain producing the final report"""
+    return SequentialChain(
+        chains=chains,
+        input_variables=["properties_chunks", "properties", "tax_guidelines", "strategy_guidelines"],
         output_variables=["final_report"],
         verbose=True
     )
 
+def build_analysis_inputs(property_list: List[Dict], guidelines: Dict[str, str]) -> Dict:
+    """
+    Assemble the inputs of the analysis chains for one portfolio.
+
+    Raises:
+        ValueError: If a single property is too large to fit in a prompt
+    """
+    return {
+        # Compact, token-counted text for the LLM stages
+        "properties_chunks": chunk_properties(property_list),
+        # Structured data for the rent computation
+        "properties": property_list,
+        **guidelines
+    }
+
+def stream_final_report(chains: List[Chain], inputs: Dict) -> Iterator[str]:
+    """
+    Run the analysis chains in order and stream the output of the last one.
+
+    The earlier stages only feed the next prompt, so they are invoked as usual;
+    the final report is streamed token by token from the last chain's LLM.
+    """
+    *stages, final_chain = chains
+    for chain in stages:
+        inputs = chain.invoke(inputs)
+
+    prompt = final_chain.prompt.format(**{key: inputs[key] for key in final_chain.prompt.input_variables})
+    for chunk in final_chain.llm.stream(prompt):
+        if chunk.content:
+            yield chunk.content
+
+async def astream_final_report(chains: List[Chain], inputs: Dict) -> AsyncIterator[str]:
+    """Async version of stream_final_report"""
+    *stages, final_chain = chains
+    for chain in stages:
+        inputs = await chain.ainvoke(inputs)
+
+    prompt = final_chain.prompt.format(**{key: inputs[key] for key in final_chain.prompt.input_variables})
+    async for chunk in final_chain.llm.astream(prompt):
+        if chunk.content:
+            yield chunk.content
+
+def run_rental_analysis(property_list: List[Dict], stream: bool = False) -> Union[str, Iterator[str]]:
+    """
+    Analyze rental properties using LangChain with vector store integration.
+    
+    Args:
+        property_list: List of property dictionaries containing rental information
+        stream: If True, return a generator yielding the final report as it is generated
+        
+    Returns:
+        str: Analysis results in markdown format, or an iterator of its chunks when streaming
+    """
+    # Reuse the shared vector store and QA chain
+    qa_chain = get_qa_chain()
+
+    # Retrieve relevant tax guidelines for each stage, from the cache unless the collection has changed.
+    # Questions that are not cached are sent concurrently.
+    fingerprint = collection_fingerprint(RENTAL_COLLECTION)
+    guidelines = fetch_guidelines(qa_chain, fingerprint)
+
+    chains = create_analysis_chains()
+    inputs = build_analysis_inputs(property_list, guidelines)
+
+    if stream:
+        return stream_final_report(chains, inputs)
+
     # Run analysis
-    result = analysis_chain.invoke({
-        "properties_list": str(property_list),
-        "tax_guidelines": tax_guidelines,
-        "computation_guidelines": computation_guidelines,
-        "strategy_guidelines": strategy_guidelines
-    })
-
-    return result["final_report"]
\ No newline at end of file
+    result = create_sequential_chain(chains).invoke(inputs)
+
+    return result["final_report"]
+
+async def arun_rental_analysis(property_list: List[Dict], stream: bool = False) -> Union[str, AsyncIterator[str]]:
+    """
+    Async version of run_rental_analysis, for callers that already run an event loop.
+    The guideline questions are sent concurrently and every LLM call is awaited rather than blocking.
+    """
+    # The first call builds the chain and loads the vector store, so it runs in a thread like the other blocking calls
+    qa_chain = await asyncio.to_thread(get_qa_chain)
+
+    fingerprint = await asyncio.to_thread(collection_fingerprint, RENTAL_COLLECTION)
+    guidelines = await afetch_guidelines(qa_chain, fingerprint)
+
+    chains = create_analysis_chains()
+    inputs = build_analysis_inputs(property_list, guidelines)
+
+    if stream:
+        return astream_final_report(chains, inputs)
+
+    result = await create_sequential_chain(chains).ainvoke(inputs)
+
+    return result["final_report"]
@@ -0,0 +1,145 @@
+# Deterministic computation of taxable rental income.
+# Replaces the LLM stage that used to do the arithmetic of the rental analysis, so the figures in the
+# report are exact and reproducible; the LLM chains only explain them.
+from typing import List, Dict, Optional
+import numpy as np
+import pandas as pd
+
+# Expense categories offered by the form that are deductible under the Actual Expense Claims method.
+# "Propety Tax" is the spelling used by the form; the correct spelling is accepted for other callers.
+ALLOWABLE_CATEGORIES = [
+    "Propety Tax",
+    "Property Tax",
+    "Mortgage Loan Interest",
+    "Fire Insurance",
+    "Maintenance Fee",
+    "Repairs",
+    "Agent Commission",
+]
+MORTGAGE_INTEREST_CATEGORY = "Mortgage Loan Interest"
+# Expense rows without a category, e.g. from an edited table or the API, are reported under the form's catch-all
+OTHER_CATEGORY = "Others"
+
+# Simplified Rental Expense Claims: 15% of the gross rent is deemed as expenses, on top of the mortgage interest
+DEEMED_EXPENSE_RATE = 0.15
+
+ACTUAL_METHOD = "Actual Expense Claims Method"
+SIMPLIFIED_METHOD = "Simplified Rental Expense Claims Method"
+
+
+def _ownership_fraction(property_info: Dict) -> float:
+    """Share of the property owned by the user, as a fraction; 100% unless the property is co-owned"""
+    if property_info.get("is_co_owned"):
+        return float(property_info.get("ownership_share") or 0.0) / 100
+    return 1.0
+
+
+def compute_rental_tax(property_list: List[Dict]) -> Dict:
+    """
+    Compute the taxable rent of every property under both claim methods.
+
+    All expense rows of all properties are combined into flat arrays and summed per property in one pass.
+    Losses are offset against the income of the other properties in the totals.
+
+    Args:
+        property_list: List of property dictionaries as kept in st.session_state.properties, i.e. with
+            "rental_income", "is_co_owned", "ownership_share" (in %) and an "expenses" DataFrame with
+            "Category", "Amount" and "Description" columns
+
+    Returns:
+        dict: "properties" with the per-property figures and expense items, "totals" per method and
+            "recommended_method", the method with the lower total taxable rent (None if both are equal)
+    """
+    num_properties = len(property_list)
+    rental_income = np.array([float(prop.get("rental_income") or 0.0) for prop in property_list])
+    ownership = np.array([_ownership_fraction(prop) for prop in property_list])
+
+    # Flatten the expense tables of all properties, remembering which property each row belongs to
+    expense_tables = [prop["expenses"] for prop in property_list]
+    property_index = np.repeat(np.arange(num_properties), [len(table) for table in expense_tables])
+    categories = np.concatenate([table["Category"].to_numpy(dtype=object) for table in expense_tables] or [np.array([], dtype=object)])
+    descriptions = np.concatenate([table["Description"].to_numpy(dtype=object) for table in expense_tables] or [np.array([], dtype=object)])
+    amounts = np.concatenate([pd.to_numeric(table["Amount"], errors="coerce").to_numpy(dtype=float) for table in expense_tables] or [np.array([])])
+    amounts = np.nan_to_num(amounts)
+    # None, NaN and blank categories would otherwise show up as "nan" or "None" in the report items
+    missing = np.array([pd.isna(category) or not str(category).strip() for category in categories], dtype=bool)
+    categories[missing] = OTHER_CATEGORY
+
+    allowable = np.isin(categories, ALLOWABLE_CATEGORIES)
+    mortgage = categories == MORTGAGE_INTEREST_CATEGORY
+
+    allowable_expenses = np.bincount(property_index, weights=amounts * allowable, minlength=num_properties)
+    non_deductible_expenses = np.bincount(property_index, weights=amounts * ~allowable, minlength=num_properties)
+    mortgage_interest = np.bincount(property_index, weights=amounts * mortgage, minlength=num_properties)
+    deemed_expenses = rental_income * DEEMED_EXPENSE_RATE
+
+    actual_taxable_rent = np.round((rental_income - allowable_expenses) * ownership, 2)
+    simplified_taxable_rent = np.round((rental_income - mortgage_interest - deemed_expenses) * ownership, 2)
+
+    properties = []
+    for i in range(num_properties):
+        rows = property_index == i
+        items = [
+            {"category": category, "amount": round(float(amount), 2), "description": "" if pd.isna(description) else str(description)}
+            for category, amount, description in zip(categories[rows], amounts[rows], descriptions[rows])
+        ]
+        properties.append({
+            "property": i + 1,
+            "rental_income": round(float(rental_income[i]), 2),
+            "ownership_share": round(float(ownership[i]) * 100, 2),
+            "allowable_expenses": round(float(allowable_expenses[i]), 2),
+            "non_deductible_expenses": round(float(non_deductible_expenses[i]), 2),
+            "mortgage_interest": round(float(mortgage_interest[i]), 2),
+            "deemed_expenses": round(float(deemed_expenses[i]), 2),
+            "actual_taxable_rent": float(actual_taxable_rent[i]),
+            "simplified_taxable_rent": float(simplified_taxable_rent[i]),
+            "allowable_items": [item for item, ok in zip(items, allowable[rows]) if ok],
+            "non_deductible_items": [item for item, ok in zip(items, allowable[rows]) if not ok],
+        })
+
+    totals = {
+        ACTUAL_METHOD: round(float(actual_taxable_rent.sum()), 2),
+        SIMPLIFIED_METHOD: round(float(simplified_taxable_rent.sum()), 2),
+    }
+    recommended_method: Optional[str] = None
+    if totals[ACTUAL_METHOD] != totals[SIMPLIFIED_METHOD]:
+        recommended_method = min(totals, key=totals.get)
+
+    return {"properties": properties, "totals": totals, "recommended_method": recommended_method}
+
+
+def _money(value: float) -> str:
+    """Format an amount in dollars, with the sign in front for losses"""
+    return f"-${-value:,.2f}" if value < 0 else f"${value:,.2f}"
+
+
+def format_computation_results(results: Dict) -> str:
+    """Render the output of compute_rental_tax as plain text for the report prompt"""
+    lines = []
+    for prop in results["properties"]:
+        lines.append(f"Property {prop['property']}")
+        lines.append(f"- Rental Income: {_money(prop['rental_income'])}")
+        lines.append(f"- Ownership share: {prop['ownership_share']:g}%")
+        for item in prop["allowable_items"]:
+            lines.append(f"- Deductible expense: {item['category']} {_money(item['amount'])} {item['description']}".rstrip())
+        for item in prop["non_deductible_items"]:
+            lines.append(f"- Not deducted (not a standard allowable category): {item['category']} {_money(item['amount'])} {item['description']}".rstrip())
+        lines.append(
+            f"- {ACTUAL_METHOD}: ({_money(prop['rental_income'])} - {_money(prop['allowable_expenses'])}) x {prop['ownership_share']:g}%"
+            f" = {_money(prop['actual_taxable_rent'])}"
+        )
+        lines.append(
+            f"- {SIMPLIFIED_METHOD}: ({_money(prop['rental_income'])} - {_money(prop['mortgage_interest'])} mortgage interest"
+            f" - {_money(prop['deemed_expenses'])} deemed expenses at {DEEMED_EXPENSE_RATE:.0%}) x {prop['ownership_share']:g}%"
+            f" = {_money(prop['simplified_taxable_rent'])}"
+        )
+        lines.append("")
+
+    for method, total in results["totals"].items():
+        lines.append(f"Total taxable rent, {method}: {_money(total)}")
+    if results["recommended_method"]:
+        lines.append(f"Lower total taxable rent: {results['recommended_method']}")
+    else:
+        lines.append("Both methods give the same total taxable rent.")
+
+    return "\n".join(lines)
@@ -0,0 +1,95 @@
+# Compact serialization of the property data sent to the tax specialist chain.
+# str(property_list) dumps the DataFrame repr of every expense table, which wastes tokens and
+# truncates large tables with "...". Each property is written instead as one header line followed
+# by its expenses as a CSV table, and the result is token-counted before it is sent.
+from typing import List, Dict
+import csv
+import io
+import os
+import pandas as pd
+from helper_functions.llm import count_tokens_batch
+
+# Token budget for the property data in one tax specialist prompt; larger portfolios are split across prompts
+MAX_PROPERTY_TOKENS = int(os.getenv("MAX_PROPERTY_TOKENS", 6000))
+# Tokens kept free in every part for the "Part x of y" header line
+PART_HEADER_TOKENS = 32
+
+
+def _number(value) -> str:
+    """Shortest exact text for an amount, e.g. 1200 rather than 1200.0"""
+    value = float(value) if pd.notna(value) else 0.0
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+
+def serialize_property(number: int, property_info: Dict) -> str:
+    """Serialize one property as a header line plus a CSV table of its expenses"""
+    co_owned = bool(property_info.get("is_co_owned"))
+    share = _number(property_info.get("ownership_share")) if co_owned else "100"
+    lines = [
+        f"Property {number}: rental_income={_number(property_info.get('rental_income'))}, "
+        f"co_owned={'True' if co_owned else 'False'}, ownership_share={share}%"
+    ]
+
+    expenses = property_info["expenses"]
+    if len(expenses):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(["Category", "Amount", "Description"])
+        for category, amount, description in zip(expenses["Category"], expenses["Amount"], expenses["Description"]):
+            writer.writerow([
+                "" if pd.isna(category) else category,
+                _number(amount),
+                "" if pd.isna(description) else description,
+            ])
+        lines.append(buffer.getvalue().rstrip("\n"))
+    else:
+        lines.append("No expenses")
+
+    return "\n".join(lines)
+
+
+def serialize_properties(property_list: List[Dict]) -> str:
+    """Serialize a whole portfolio, one property block after another"""
+    return "\n\n".join(serialize_property(i + 1, prop) for i, prop in enumerate(property_list))
+
+
+def chunk_properties(property_list: List[Dict], max_tokens: int = MAX_PROPERTY_TOKENS) -> List[str]:
+    """
+    Serialize a portfolio into as few parts as possible that each fit in max_tokens.
+
+    Properties are never split, and keep their numbering across parts. A single part is returned
+    unchanged; when the portfolio has to be split, each part starts with a line saying which properties it holds.
+
+    Raises:
+        ValueError: If a single property does not fit in max_tokens on its own
+    """
+    blocks = [serialize_property(i + 1, prop) for i, prop in enumerate(property_list)]
+    block_tokens = count_tokens_batch(blocks)
+    budget = max_tokens - PART_HEADER_TOKENS
+
+    for number, tokens in enumerate(block_tokens, start=1):
+        if tokens > budget:
+            raise ValueError(
+                f"Property {number} needs {tokens} tokens, more than the {budget} allowed per prompt. "
+                "Please combine or remove some of its expense rows."
+            )
+
+    # Group consecutive properties greedily; the blank line between blocks is about one token
+    groups, current, current_tokens = [], [], 0
+    for number, (block, tokens) in enumerate(zip(blocks, block_tokens), start=1):
+        if current and current_tokens + tokens + 1 > budget:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append((number, block))
+        current_tokens += tokens + 1
+    if current:
+        groups.append(current)
+
+    if len(groups) <= 1:
+        return ["\n\n".join(block for _, block in group) for group in groups] or [""]
+
+    return [
+        f"Part {part} of {len(groups)}: properties {group[0][0]} to {group[-1][0]} "
+        f"of {len(property_list)} in total\n\n" + "\n\n".join(block for _, block in group)
+        for part, group in enumerate(groups, start=1)
+    ]
@@ -126,7 +126,7 @@ def show_methodology():
          - Evaluates each expense category
          - Determines tax deductibility
          - Performs detailed tax research when needed
-       - Computation Methods:
+       - Computation Methods (calculated exactly by a rules engine, not the LLM):
          - Actual Expense Method: Detailed expense deductions
          - Simplified Method: 15% deemed expenses plus mortgage interest
        - Strategy Assessment: Identifies optimal tax approach
@@ -0,0 +1,20 @@
+# ================== Note =================
+# Command line entry point for analysing many rental portfolios in one run
+# Refer to logics/rentalbatch.py for the input formats
+# Usage: python run_rental_batch.py portfolios.jsonl reports.jsonl --concurrency 8
+# ================== ==== =================
+
+import argparse
+from dotenv import load_dotenv
+from logics.rentalbatch import run_batch_analysis, BATCH_CONCURRENCY
+
+load_dotenv('.env')
+
+parser = argparse.ArgumentParser(description="Generate rental income reports for many portfolios")
+parser.add_argument("input_path", help="Portfolios as a .jsonl or .csv file")
+parser.add_argument("output_path", help="JSONL file the reports are written to as they finish")
+parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Portfolios analysed at the same time")
+args = parser.parse_args()
+
+summary = run_batch_analysis(args.input_path, args.output_path, max_concurrency=args.concurrency)
+print(f"Completed: {summary['completed']}, failed: {summary['failed']}, in {summary['seconds']}s")